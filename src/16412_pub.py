@@ -14,6 +14,8 @@ except IndexError:
 
 import carla
 
+from carla_recorder import Recorder
+
 import argparse
 import logging
 import random
@@ -76,6 +78,11 @@ def main():
         metavar='PATTERN',
         default='vehicle.*',
         help='vehicles filter (default: "vehicle.*")')
+    argparser.add_argument(
+        '-o', '--output_dir',
+        metavar='DIR',
+        default='recordings',
+        help='directory of the per-vehicle .txt recordings (default: recordings)')
     args = argparser.parse_args()
 
     logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
@@ -84,13 +91,7 @@ def main():
     client.set_timeout(10.0)
     print("Recording simulation playback on file: %s" % client.start_recorder("test1.log"))
 
-    # Create output .txt file for all agents and include a header
-    for i in range(args.number_of_vehicles):
-        myrecording = open(r"D:\carla\CARLAUE4\Saved\myrecording%d.txt" % (i),"w+")
-        myrecording.write('Simulation Frame | Timestamp | Position | Velocity ' +
-                          '| Heading | Angular Velocity | Acceleration | ' +
-                              'Stopped at Red Light + Light ID \n')
-        myrecording.close()
+    recorder = None
     try:
         client.load_world(selected_map) # Load a new map (Town02 in this case)
         client.reload_world()
@@ -171,6 +172,10 @@ def main():
 
         print('Spawned %d vehicles, press Ctrl+C to exit.' % (args.number_of_vehicles))
 
+        # Buffered writer of the output .txt files (one per vehicle, with a
+        # header), see carla_recorder.py
+        recorder = Recorder(args.output_dir, len(actor_list), geofence)
+
         # wait for a tick to ensure client receives the last transform of the vehicles we have just created
         if not args.sync or not synchronous_master:
             framestamp = world.wait_for_tick()
@@ -182,7 +187,6 @@ def main():
         # --------------
         # Game loop. Prevents the script from finishing.
         # --------------
-        headings = np.zeros(args.number_of_vehicles) # Initialize headings of vehicles
         while True:
                  
             if args.sync and synchronous_master:
@@ -200,67 +204,7 @@ def main():
                         print(str(time_elapsed)+'\n')
             
             if not (np.mod(current_frame,10)):
-                for i in range(args.number_of_vehicles):
-                    myrecording = open(r"D:\carla\CarlaUE4\Saved\myrecording%d.txt" % (i),"a")
-                    
-                    # Check if vehicle stopped by traffic light
-                    red_light = 0
-                    if actor_list[i].is_at_traffic_light():
-                        traffic_light = actor_list[i].get_traffic_light()
-                        red_light = 1
-                    
-                    # Apply geofence
-                    location = actor_list[i].get_location()
-                    if location.x > geofence[0] and location.x < geofence[1] and \
-                        location.y > geofence[2] and location.y < geofence[3]:
-                    
-                        # Convert x-y-z to Lat,Lon,Alt (unused at the moment)
-                        coords = Map.transform_to_geolocation(location)
-                        
-                        # Compute heading
-                        speed = math.sqrt(actor_list[i].get_velocity().x**2 + \
-                                          actor_list[i].get_velocity().y**2)
-                        
-                        # Compute new heading is vehicle is moving
-                        if speed > 1:
-                            heading = round(np.mod(math.atan2(actor_list[i].get_velocity().x, \
-                                            actor_list[i].get_velocity().y)*180/math.pi, 360),1)
-                            headings[i] = heading
-                        else:
-                            # If speed is low (i.e. vehicle is stopped, use 
-                            # last recorded heading).
-                            heading = headings[i]
-                       
-                        # Convert data values to strings before outputting
-                        my_frame = str(current_frame) + ' | '
-                        my_timestamp = str(time_elapsed) + ' | '
-                        my_location = str(location.x) + ',' + str(location.y) + \
-                            ',' + str(location.z) + ' | '
-                        my_velocity = str(actor_list[i].get_velocity().x) + \
-                            ',' + str(actor_list[i].get_velocity().y) + ',' + \
-                                str(actor_list[i].get_velocity().z) + ' | '
-                        my_heading = str(heading) + ' | '
-                        my_angular_velocity = str(actor_list[i].get_angular_velocity().x) + \
-                            ',' + str(actor_list[i].get_angular_velocity().y) + ',' + \
-                                str(actor_list[i].get_angular_velocity().z) + ' | '
-                        my_acceleration = str(actor_list[i].get_acceleration().x) + \
-                            ',' + str(actor_list[i].get_acceleration().y) + ',' + \
-                                str(actor_list[i].get_acceleration().z) + ' | '
-                        if red_light:
-                            my_light = str(red_light) + ',' + str(traffic_light.id) + '\n'
-                        else:
-                            my_light = str(red_light) + ',0\n'
-                        
-                        # Write to output .txt file
-                        myrecording.write(my_frame)
-                        myrecording.write(my_timestamp)
-                        myrecording.write(my_location)
-                        myrecording.write(my_velocity)
-                        myrecording.write(my_heading)
-                        myrecording.write(my_angular_velocity)
-                        myrecording.write(my_acceleration)
-                        myrecording.write(my_light)
-                        myrecording.close()
+                recorder.record(current_frame, time_elapsed, actor_list, world.get_snapshot())
 
     finally:
         # --------------
@@ -268,9 +212,11 @@ def main():
         # --------------
         
         client.stop_recorder()
+        if recorder is not None:
+            recorder.close()
         print('--------------------------------------------')
         print('Playback file saved to ~\CarlaUE4\Saved')
-        print('Output .txt files saved to ~\CarlaUE4\Saved')
+        print('Output .txt files saved to %s' % args.output_dir)
         na = 0
         actors = world.get_actors()
         for a in actors.filter('vehicle.*'):
@@ -0,0 +1,302 @@
+"""
+16.412 Intent Inference GC | carla_recorder.py
+Recorder backend of 16412_pub.py. Writes the per vehicle myrecording%d.txt
+files read by parse_data.py, but keeps every file open and buffered for the
+whole run. Each recorded tick reads every actor's state once (from a world
+snapshot) into NumPy arrays and computes geofence membership, speed and
+heading for all actors in one vectorized step. The values are handed to a
+background thread that formats and writes the rows and flushes in batches,
+so the simulation loop never waits on file I/O.
+
+Record with the local carla stand-in (fake_carla.py) and compare the tick
+latency with the original open/append/close per vehicle writes:
+    python carla_recorder.py --fake --benchmark -n 50
+"""
+import os
+import math
+import time
+import queue
+import shutil
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+HEADER = 'Simulation Frame | Timestamp | Position | Velocity ' + \
+         '| Heading | Angular Velocity | Acceleration | ' + \
+         'Stopped at Red Light + Light ID \n'
+RECORDING_FNAME = "myrecording%d.txt"
+
+# Geofence of the recorded intersection in Town02:
+# lower x-bound, upper x-bound, lower y-bound, upper y-bound
+GEOFENCE = [98.118385, 169.524979, 170.196945, 226.819290]
+
+
+def actor_arrays(actor_list, snapshot=None):
+    """
+    Reads the state of every actor once: returns the per-actor state objects
+    (ActorSnapshots of snapshot, a world.get_snapshot(), if given, otherwise
+    the actors), their locations and velocities, and the x-y positions and
+    velocities as [N, 2] arrays.
+    """
+    if snapshot is not None:
+        states = [snapshot.find(actor.id) for actor in actor_list]
+        locations = [state.get_transform().location for state in states]
+    else:
+        states = actor_list
+        locations = [actor.get_location() for actor in actor_list]
+    velocities = [state.get_velocity() for state in states]
+    positions = np.array([(location.x, location.y) for location in locations], dtype=np.float64).reshape(-1, 2)
+    planar_velocities = np.array([(velocity.x, velocity.y) for velocity in velocities], dtype=np.float64).reshape(-1, 2)
+    return states, locations, velocities, positions, planar_velocities
+
+def in_geofence(positions, geofence):
+    """ Mask of the [N, 2] positions strictly inside geofence. """
+    x, y = positions[:, 0], positions[:, 1]
+    return (x > geofence[0]) & (x < geofence[1]) & (y > geofence[2]) & (y < geofence[3])
+
+def vector_string(vector):
+    return str(vector.x) + ',' + str(vector.y) + ',' + str(vector.z)
+
+def format_row(prefix, values, heading):
+    """
+    One line of a recording, in the format of the HEADER columns. prefix is
+    the frame and timestamp columns; values holds the x, y, z of location,
+    velocity, angular velocity and acceleration, then the id of the traffic
+    light the vehicle is stopped at (None if it is not).
+    """
+    strings = [str(value) for value in values[:12]]
+    light_id = values[12]
+    return prefix + ','.join(strings[0:3]) + ' | ' + ','.join(strings[3:6]) + ' | ' + str(heading) + ' | ' + \
+           ','.join(strings[6:9]) + ' | ' + ','.join(strings[9:12]) + ' | ' + \
+           ('0,0' if light_id is None else '1,' + str(light_id)) + '\n'
+
+class Recorder:
+    """
+    Records the vehicles of actor_list inside geofence to
+    output_dir/myrecording%d.txt (one file per vehicle, numbered by position
+    in actor_list). record() reads the actors and queues the values of the
+    tick; a writer thread formats and appends the rows and flushes every
+    flush_every ticks. Use as a context manager, or call close() to write
+    everything out.
+    """
+
+    def __init__(self, output_dir, num_vehicles, geofence=GEOFENCE, flush_every=20, buffer_size=1 << 16, \
+                 max_queued_ticks=256):
+        self.output_dir = output_dir
+        self.geofence = geofence
+        self.flush_every = flush_every
+        self.headings = np.zeros(num_vehicles) # last heading of every vehicle, kept while stopped
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.files = []
+        for i in range(num_vehicles):
+            recording = open(os.path.join(output_dir, RECORDING_FNAME % i), "w", buffering=buffer_size)
+            recording.write(HEADER)
+            self.files.append(recording)
+
+        # bounded, so a stalled writer slows the recording loop down instead of filling memory
+        self.queue = queue.Queue(maxsize=max_queued_ticks)
+        self.error = None # exception that stopped the writer thread, raised by record and close
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def update_headings(self, moving, velocities):
+        """
+        Headings in degrees of the vehicles in the moving mask from their
+        [N, 2] velocities. Stopped vehicles keep their last heading.
+        """
+        vx, vy = velocities[moving, 0], velocities[moving, 1]
+        self.headings[moving] = np.round(np.arctan2(vx, vy)*180/np.pi % 360, 1)
+        return self.headings
+
+    def record(self, frame, timestamp, actor_list, snapshot=None):
+        """
+        Records one tick of the vehicles in actor_list, read from snapshot
+        (world.get_snapshot()) if given. Geofence, speed and heading are
+        computed for all vehicles at once.
+        """
+        if self.error is not None:
+            raise self.error
+        states, locations, velocities, positions, planar_velocities = actor_arrays(actor_list, snapshot)
+        inside = in_geofence(positions, self.geofence)
+        moving = inside & (np.sqrt((planar_velocities**2).sum(1)) > 1)
+        headings = self.update_headings(moving, planar_velocities)[inside].tolist()
+
+        # Only numbers are gathered here, the rows are formatted by the writer thread
+        indices = np.flatnonzero(inside).tolist()
+        values = []
+        for i in indices:
+            location, velocity = locations[i], velocities[i]
+            angular_velocity, acceleration = states[i].get_angular_velocity(), states[i].get_acceleration()
+            actor = actor_list[i]
+            light_id = actor.get_traffic_light().id if actor.is_at_traffic_light() else None
+            values.append((location.x, location.y, location.z, velocity.x, velocity.y, velocity.z, \
+                           angular_velocity.x, angular_velocity.y, angular_velocity.z, \
+                           acceleration.x, acceleration.y, acceleration.z, light_id))
+        if not self._put((str(frame) + ' | ' + str(timestamp) + ' | ', indices, headings, values)):
+            raise self.error
+
+    def _put(self, tick):
+        """ Queues tick, waiting while the queue is full. False if the writer thread failed. """
+        while self.error is None:
+            try:
+                self.queue.put(tick, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _write_loop(self):
+        ticks = 0
+        while True:
+            tick = self.queue.get()
+            if tick is None:
+                break
+            prefix, indices, headings, values = tick
+            try:
+                for i, heading, row_values in zip(indices, headings, values):
+                    self.files[i].write(format_row(prefix, row_values, heading))
+                ticks += 1
+                if ticks % self.flush_every == 0:
+                    for recording in self.files:
+                        recording.flush()
+            except Exception as error:
+                self.error = error
+                break
+
+    def close(self):
+        """ Writes all queued rows and closes the files. """
+        if self.writer.is_alive():
+            self._put(None)
+            self.writer.join()
+        for recording in self.files:
+            recording.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class LegacyRecorder:
+    """
+    The original recording loop of 16412_pub.py: every vehicle's file is
+    opened, appended to and closed on every recorded tick, and the actor is
+    queried for its velocity several times per row. Kept as the baseline of
+    the benchmark.
+    """
+
+    def __init__(self, output_dir, num_vehicles, geofence=GEOFENCE):
+        self.output_dir = output_dir
+        self.geofence = geofence
+        self.headings = [0.0] * num_vehicles
+        os.makedirs(output_dir, exist_ok=True)
+        for i in range(num_vehicles):
+            with open(os.path.join(output_dir, RECORDING_FNAME % i), "w+") as recording:
+                recording.write(HEADER)
+
+    def record(self, frame, timestamp, actor_list, snapshot=None):
+        for i, actor in enumerate(actor_list):
+            recording = open(os.path.join(self.output_dir, RECORDING_FNAME % i), "a")
+            red_light = 0
+            if actor.is_at_traffic_light():
+                traffic_light = actor.get_traffic_light()
+                red_light = 1
+            location = actor.get_location()
+            if location.x > self.geofence[0] and location.x < self.geofence[1] and \
+               location.y > self.geofence[2] and location.y < self.geofence[3]:
+                speed = math.sqrt(actor.get_velocity().x**2 + actor.get_velocity().y**2)
+                if speed > 1:
+                    self.headings[i] = round(math.atan2(actor.get_velocity().x, \
+                                             actor.get_velocity().y)*180/math.pi % 360, 1)
+                heading = self.headings[i]
+                recording.write(str(frame) + ' | ')
+                recording.write(str(timestamp) + ' | ')
+                recording.write(vector_string(location) + ' | ')
+                recording.write(vector_string(actor.get_velocity()) + ' | ')
+                recording.write(str(heading) + ' | ')
+                recording.write(vector_string(actor.get_angular_velocity()) + ' | ')
+                recording.write(vector_string(actor.get_acceleration()) + ' | ')
+                if red_light:
+                    recording.write(str(red_light) + ',' + str(traffic_light.id) + '\n')
+                else:
+                    recording.write(str(red_light) + ',0\n')
+            recording.close()
+
+    def close(self):
+        pass
+
+def record_loop(world, actor_list, recorder, num_frames, record_every=10):
+    """
+    Ticks world num_frames times and records actor_list every record_every
+    frames, as the game loop of 16412_pub.py does. Returns the wall clock
+    seconds spent in every recorded tick.
+    """
+    snapshot = world.wait_for_tick()
+    frame_zero, time_zero = snapshot.frame, snapshot.elapsed_seconds
+    tick_seconds = []
+    for i in range(num_frames):
+        snapshot = world.wait_for_tick()
+        current_frame = snapshot.frame - frame_zero
+        if not current_frame % record_every:
+            actor_snapshots = world.get_snapshot()
+            start = time.perf_counter()
+            recorder.record(current_frame, snapshot.elapsed_seconds - time_zero, actor_list, actor_snapshots)
+            tick_seconds.append(time.perf_counter() - start)
+    return tick_seconds
+
+def connect(args):
+    """ World and vehicles of the simulator, or of the local stand-in with --fake. """
+    if args.fake:
+        import fake_carla
+        client = fake_carla.Client(args.host, args.port, num_vehicles=args.number_of_vehicles)
+    else:
+        import carla
+        client = carla.Client(args.host, args.port)
+        client.set_timeout(10.0)
+    world = client.get_world()
+    return world, list(world.get_actors().filter('vehicle.*'))[:args.number_of_vehicles]
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description='Records CARLA vehicles to per-vehicle .txt files.')
+    parser.add_argument('--fake', action='store_true', help='Use the local carla stand-in (fake_carla.py).')
+    parser.add_argument('--host', default='127.0.0.1', help='IP of the host server.')
+    parser.add_argument('-p', '--port', default=2000, type=int, help='TCP port to listen to.')
+    parser.add_argument('-n', '--number-of-vehicles', default=50, type=int, help='Number of vehicles.')
+    parser.add_argument('--frames', default=2000, type=int, help='Simulation frames to run.')
+    parser.add_argument('--output_dir', default='recordings', help='Directory of the .txt recordings.')
+    parser.add_argument('--benchmark', action='store_true', \
+                        help='Compare the tick latency and output with the original recording loop.')
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    if not args.benchmark:
+        world, actor_list = connect(args)
+        with Recorder(args.output_dir, len(actor_list)) as recorder:
+            record_loop(world, actor_list, recorder, args.frames)
+        print("Recorded {} vehicles for {} frames to {}".format(len(actor_list), args.frames, args.output_dir))
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        for name, recorder_type in [("legacy", LegacyRecorder), ("buffered", Recorder)]:
+            world, actor_list = connect(args)
+            recorder = recorder_type(os.path.join(tmp_dir, name), len(actor_list))
+            start = time.perf_counter()
+            tick_seconds = record_loop(world, actor_list, recorder, args.frames)
+            recorder.close()
+            total = time.perf_counter() - start
+            mean_seconds = sum(tick_seconds) / len(tick_seconds)
+            print("{:<8s} {:8.3f} ms per recorded tick ({:.1f} us per vehicle, max {:.3f} ms), {:.2f} s total".format( \
+                  name, 1000 * mean_seconds, 1e6 * mean_seconds / len(actor_list), 1000 * max(tick_seconds), total))
+        if args.fake:
+            # the stand-in replays the same simulation, so the recordings must match
+            identical = all(open(os.path.join(tmp_dir, "legacy", fname)).read() == \
+                            open(os.path.join(tmp_dir, "buffered", fname)).read() \
+                            for fname in os.listdir(os.path.join(tmp_dir, "legacy")))
+            print("Identical recordings: {}".format(identical))
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,239 @@
+"""
+16.412 Intent Inference GC | benchmark.py
+Times the stages of the load -> predict -> score -> render pipeline
+separately, on the bundled eth/ucy datasets and on synthetic scenes, and
+writes wall time, memory and samples/sec per stage to a .json file so runs
+can be compared.
+
+    python benchmark.py --out benchmark_results.json
+    python benchmark.py --datasets ../datasets/CARLA_long --synthetic 10000
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import platform
+import resource
+import tempfile
+import argparse
+
+import numpy as np
+import torch
+import torch.utils.data as Data
+
+from cvm import *
+from metrics import *
+from ped_dataset import PedDataset
+from dataset_cache import load_columns, save_columns
+from plotting import frame_points, trajectory_bounds, FrameRenderer
+
+DEFAULT_DATASETS = ["data/eth_hotel", "data/eth_univ", "data/ucy_univ",
+                    "data/ucy_zara01", "data/ucy_zara02"]
+
+OBSERVED_HISTORY = 8
+PREDICTION_HORIZON = 9
+SEQUENCE_LENGTH = OBSERVED_HISTORY + PREDICTION_HORIZON
+MIN_SEQUENCE_LENGTH = 10
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process so far (over all stages). """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.**2 if sys.platform == "darwin" else 1024.)
+
+def proc_status_mb(field):
+    """ A memory field (VmRSS, VmHWM) of /proc/self/status, None without procfs. """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024.
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    """
+    Resets the peak RSS (VmHWM) of this process to its current RSS, so the
+    next reading is the peak of one stage. False where this is not supported
+    (only Linux has /proc/self/clear_refs).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+class StageTimer:
+    """ Collects one result row per timed stage. """
+
+    def __init__(self):
+        self.results = []
+        # ru_maxrss is reset with the peak RSS, so the process peak is kept here
+        self.process_peak_mb = peak_rss_mb()
+
+    def time(self, dataset, stage, fn, items=None):
+        """
+        Runs fn() and records its wall time and memory. items is the number
+        of samples processed (for samples/sec), or a function of fn's return
+        value. stage_peak_rss_mb is the peak RSS while fn ran (None where it
+        cannot be reset, see reset_peak_rss) and rss_delta_mb the RSS it left
+        allocated; process_peak_rss_mb is the peak of the whole run so far.
+        """
+        rss_before = proc_status_mb("VmRSS")
+        peak_reset = reset_peak_rss()
+        start = time.perf_counter()
+        value = fn()
+        seconds = time.perf_counter() - start
+        rss_after = proc_status_mb("VmRSS")
+        self.process_peak_mb = max(self.process_peak_mb, peak_rss_mb())
+        if callable(items):
+            items = items(value)
+        result = {"dataset": dataset, "stage": stage, "seconds": seconds, "items": items,
+                  "stage_peak_rss_mb": proc_status_mb("VmHWM") if peak_reset else None,
+                  "rss_delta_mb": rss_after - rss_before if rss_before is not None else None,
+                  "process_peak_rss_mb": self.process_peak_mb,
+                  "items_per_sec": items / seconds if items and seconds > 0 else None}
+        self.results.append(result)
+        print("{:<20s} {:<16s} {:9.4f} s {:>14s} {:>16s}".format(dataset, stage, seconds, \
+              "{:.0f}/s".format(result["items_per_sec"]) if result["items_per_sec"] else "", \
+              "peak {:.0f} MB".format(result["stage_peak_rss_mb"]) if result["stage_peak_rss_mb"] else ""))
+        return value
+
+def synthetic_columns(num_agents, num_frames, seed=0):
+    """
+    Columnar detections (see dataset_cache.detections_to_columns) of
+    num_agents agents walking with constant velocities and slowly turning,
+    all present in every frame.
+    """
+    rng = np.random.default_rng(seed)
+    start = rng.uniform(0, 100, (num_agents, 2))
+    speed = rng.uniform(0.5, 1.5, num_agents)
+    heading = rng.uniform(-np.pi, np.pi, num_agents)
+    turn_rate = rng.normal(0, 0.05, num_agents)
+
+    t = np.arange(num_frames)[:, None]
+    angles = heading + turn_rate * t
+    steps = np.stack([np.cos(angles), np.sin(angles)], axis=-1) * speed[:, None]
+    positions = start + np.cumsum(steps, axis=0) # [frames, agents, 2]
+
+    counters = np.arange(1, num_frames + 1)
+    return {
+        "timestamps": np.arange(num_frames, dtype=np.float64),
+        "detection_ids": counters,
+        "detection_files": np.array([str(c) + ".json" for c in counters]),
+        "frame_offsets": np.arange(num_frames + 1, dtype=np.int64) * num_agents,
+        "obj_ids": np.tile(np.arange(num_agents, dtype=np.int64), num_frames),
+        "positions": positions.reshape(-1, 2).round(2),
+        "headings": np.degrees(np.mod(angles, 2*np.pi)).reshape(-1),
+    }
+
+def write_synthetic_dataset(dataset_path, num_agents, num_frames):
+    """ Writes a packed synthetic dataset that PedDataset can load. """
+    os.makedirs(dataset_path, exist_ok=True)
+    save_columns(dataset_path, synthetic_columns(num_agents, num_frames), [])
+    with open(os.path.join(dataset_path, "dataset_info.json"), "w") as info_file:
+        json.dump({"dataset_name": os.path.basename(dataset_path)}, info_file)
+
+def load_all(dataset):
+    """ All windows of dataset through __getitem__, stacked. """
+    items = [dataset[i] for i in range(len(dataset))]
+    observed = torch.stack([x[0] for x, y in items])
+    headings = torch.stack([x[1] for x, y in items])
+    y_delta = torch.stack([y[0] for x, y in items])
+    masks = torch.stack([y[1] for x, y in items])
+    return observed, headings, y_delta, masks
+
+def iterate_loader(dataset, batch_size=4096):
+    loader = Data.DataLoader(dataset=dataset, batch_size=batch_size, shuffle=False)
+    return sum(len(batch_x[0]) for batch_x, batch_y in loader)
+
+def benchmark_dataset(timer, dataset_path, name=None, from_json=True, plot_frames=10):
+    name = name or os.path.basename(os.path.normpath(dataset_path))
+    kwargs = dict(sequence_length=SEQUENCE_LENGTH, observed_history=OBSERVED_HISTORY, \
+                  min_sequence_length=MIN_SEQUENCE_LENGTH)
+
+    if from_json:
+        timer.time(name, "load_json", lambda: PedDataset(dataset_path, use_cache=False, **kwargs), len)
+        if load_columns(dataset_path) is None:
+            PedDataset(dataset_path, **kwargs) # write the cache
+    dataset = timer.time(name, "load_cached", lambda: PedDataset(dataset_path, **kwargs), len)
+
+    observed, headings, y_delta, masks = timer.time(name, "getitem", lambda: load_all(dataset), len(dataset))
+    timer.time(name, "dataloader", lambda: iterate_loader(dataset), lambda n: n)
+    timer.time(name, "materialize", dataset.materialize, len(dataset))
+    timer.time(name, "batches", lambda: sum(len(batch_x[0]) for batch_x, batch_y in dataset.batches(4096)), lambda n: n)
+
+    with torch.no_grad():
+        true_positions = rel_to_abs(y_delta, observed[:, -1])
+        last_pos = observed[:, -1]
+        generator = torch.Generator().manual_seed(0)
+
+        plain = timer.time(name, "cvm_plain", lambda: constant_velocity_model( \
+                observed, headings, prediction_horizon=PREDICTION_HORIZON), len(dataset))
+        timer.time(name, "cvm_angvel", lambda: constant_velocity_model( \
+                observed, headings, prediction_horizon=PREDICTION_HORIZON, use_angvel=True), len(dataset))
+        sampled = timer.time(name, "cvm_sampled", lambda: constant_velocity_model( \
+                observed, headings, prediction_horizon=PREDICTION_HORIZON, sample=True, \
+                generator=generator), len(dataset))
+
+        predicted = rel_to_abs(plain, last_pos)
+        predicted_sampled = rel_to_abs(sampled, last_pos.unsqueeze(1))
+        timer.time(name, "metrics", lambda: (avg_disp(predicted, [true_positions, masks]).mean().item(), \
+                final_disp(predicted, [true_positions, masks]).mean().item()), len(dataset))
+        timer.time(name, "metrics_sampled", lambda: (avg_disp(predicted_sampled, [true_positions, masks]).mean().item(), \
+                final_disp(predicted_sampled, [true_positions, masks]).mean().item()), len(dataset))
+
+    if plot_frames:
+        timestamps = dataset.window_timestamps(OBSERVED_HISTORY-1)
+        frames = []
+        for ts in np.unique(timestamps)[:plot_frames]:
+            idxs = np.flatnonzero(timestamps == ts)
+            frames.append([{"observed": observed[i:i+1], "predicted": predicted[i:i+1], \
+                            "true": true_positions[i:i+1], "ts": ts} for i in idxs])
+        geofence = dataset.geofence or trajectory_bounds(frames)
+
+        def render():
+            renderer = FrameRenderer(geofence, background=dataset.geofence is not None)
+            for frame in frames:
+                renderer.render(frame_points(frame, geofence))
+            return len(frames)
+        timer.time(name, "plot_frames", render, lambda n: n)
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description='Benchmarks the CVM evaluation pipeline stage by stage.')
+    parser.add_argument('--datasets', nargs='*', default=DEFAULT_DATASETS, help='Dataset directories to benchmark.')
+    parser.add_argument('--synthetic', nargs='*', type=int, default=[100, 1000, 10000], help='Agent counts of synthetic scenes.')
+    parser.add_argument('--frames', default=40, type=int, help='Frames per synthetic scene.')
+    parser.add_argument('--plot_frames', default=10, type=int, help='Frames rendered per dataset.')
+    parser.add_argument('--out', default='benchmark_results.json', help='Output .json file.')
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    timer = StageTimer()
+
+    for dataset_path in args.datasets:
+        benchmark_dataset(timer, dataset_path, plot_frames=args.plot_frames)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for num_agents in args.synthetic:
+            name = "synthetic_%d" % num_agents
+            dataset_path = os.path.join(tmpdir, name)
+            timer.time(name, "generate", lambda: write_synthetic_dataset(dataset_path, num_agents, args.frames), \
+                       num_agents * args.frames)
+            benchmark_dataset(timer, dataset_path, name, from_json=False, plot_frames=args.plot_frames)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+              "torch": torch.__version__, "numpy": np.__version__, "platform": platform.platform(),
+              "results": timer.results}
+    with open(args.out, "w") as out_file:
+        json.dump(report, out_file, indent=2)
+    print("Results written to {}".format(args.out))
@@ -0,0 +1,103 @@
+"""
+16.412 Intent Inference GC | cvm.py
+Batched Constant Velocity Model (CVM). All functions operate on whole batches
+of trajectories laid out as [N, timesteps, 2] so an entire dataset can be
+predicted with a handful of tensor operations.
+"""
+import numpy as np
+import torch
+
+
+def rel_to_abs(rel_traj, start_pos):
+    """
+    rel_traj: [N, horizon, 2] displacements
+    start_pos: [N, 2] last observed positions
+    Returns [N, horizon, 2] absolute positions.
+    """
+    displacement = torch.cumsum(rel_traj, dim=-2)
+    return displacement + start_pos.unsqueeze(-2)
+
+def rotate(vectors, theta):
+    """
+    Rotates 2D row vectors counterclockwise by theta (radians). theta must
+    broadcast against vectors[..., 0].
+    """
+    c, s = torch.cos(theta), torch.sin(theta)
+    x, y = vectors[..., 0], vectors[..., 1]
+    return torch.stack([x*c - y*s, x*s + y*c], dim=-1)
+
+def wrap_angle(theta):
+    """ Normalizes angles to the range (-pi, pi]. """
+    theta = torch.where(theta > np.pi, theta - 2*np.pi, theta)
+    theta = torch.where(theta <= -np.pi, theta + 2*np.pi, theta)
+    return theta
+
+def angular_velocity(observed, headings=None, from_headings=False,
+        average_thetas=False):
+    """
+    Per-agent change of direction over the last observed step(s).
+    observed: [N, obs, 2], headings: [N, obs]
+    Returns [N] angles in (-pi, pi].
+    """
+    if from_headings:
+        dthetas = headings[:, 1:] - headings[:, :-1]
+        theta1 = dthetas[:, -1]
+        theta2 = dthetas[:, -2]
+    else:
+        obs_rel = observed[:, -3:] - observed[:, -4:-1]
+        angles = torch.atan2(obs_rel[..., 1], obs_rel[..., 0])
+        theta1 = angles[:, -1] - angles[:, -2]
+        theta2 = angles[:, -2] - angles[:, -3]
+    if average_thetas:
+        theta = (theta1 + theta2)/2
+    else:
+        theta = theta1
+    return wrap_angle(theta)
+
+def sample_rotations(y_pred_rel, num_samples, sample_angle_std, generator=None):
+    """
+    Draws num_samples Gaussian rotation angles (std in degrees) per agent and
+    applies them to the predicted displacements (OUR-S).
+    y_pred_rel: [N, horizon, 2]
+    Returns [N, num_samples, horizon, 2].
+    """
+    angles = torch.randn(len(y_pred_rel), num_samples, generator=generator,
+                         dtype=y_pred_rel.dtype)
+    angles = angles * sample_angle_std * np.pi / 180.
+    return rotate(y_pred_rel.unsqueeze(1), angles.unsqueeze(2))
+
+def constant_velocity_model(observed, headings=None, prediction_horizon=9,
+        use_angvel=False, sample=False, num_samples=20, sample_angle_std=25,
+        generator=None, from_headings=False, average_thetas=False,
+        damping_factor=0.95):
+    """
+    Predicts future displacements for every agent in the batch at once.
+
+    observed: [N, obs, 2] observed positions
+    headings: [N, obs] observed headings (only used with from_headings)
+    Returns [N, prediction_horizon, 2] predicted displacements, or
+    [N, num_samples, prediction_horizon, 2] if sample is true.
+
+    use_angvel: Rotate the last velocity by the extrapolated angular velocity
+    sample: Rotate the prediction by num_samples angles drawn from
+    N(0, sample_angle_std) degrees using generator (OUR-S)
+    from_headings: Use headings to generate angular velocities (otherwise use
+    past few positions)
+    average_thetas: Use average of last two theta differences (otherwise
+    extrapolate from last theta difference alone)
+    damping_factor: Discount theta by a factor of damping_factor**i on the
+    ith future timestep
+    """
+    deltas = observed[:, -1] - observed[:, -2]
+    if use_angvel:
+        theta = angular_velocity(observed, headings, from_headings=from_headings,
+                                 average_thetas=average_thetas)
+        steps = torch.arange(1, prediction_horizon+1, dtype=observed.dtype)
+        step_angles = theta.unsqueeze(1) * steps * (damping_factor**steps)
+        y_pred_rel = rotate(deltas.unsqueeze(1), step_angles)
+    else:
+        y_pred_rel = deltas.unsqueeze(1).repeat(1, prediction_horizon, 1)
+    if sample:
+        y_pred_rel = sample_rotations(y_pred_rel, num_samples, sample_angle_std,
+                                      generator=generator)
+    return y_pred_rel
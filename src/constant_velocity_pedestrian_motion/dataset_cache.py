@@ -0,0 +1,243 @@
+"""
+16.412 Intent Inference GC | dataset_cache.py
+Packs a dataset directory of per-frame .json detections into a single
+columnar .npz file so PedDataset does not have to re-parse every frame on
+each run. The cache stores a manifest of the source files (name, mtime,
+size) and is ignored as soon as any of them changes. The columns are stored
+uncompressed and memory mapped on load, so a query only reads the rows of
+the frames it selects.
+
+Precompile datasets with
+    python dataset_cache.py path_to_dataset [path_to_dataset ...]
+"""
+import os
+import glob
+import struct
+import zipfile
+import argparse
+
+import numpy as np
+
+CACHE_FNAME = "dataset_cache.npz"
+CACHE_VERSION = 1
+FRAME_KEYS = ("timestamps", "detection_ids", "detection_files") # one value per frame
+ROW_KEYS = ("obj_ids", "positions", "headings") # one value per detection
+
+
+def cache_path(dataset_path):
+    return os.path.join(dataset_path, CACHE_FNAME)
+
+def detection_paths(dataset_path):
+    return glob.glob(os.path.join(dataset_path, 'data', '*.json'))
+
+def source_manifest(paths):
+    """
+    Returns (names, mtimes, sizes) arrays of the given files, sorted by name.
+    """
+    paths = sorted(paths)
+    stats = [os.stat(p) for p in paths]
+    names = np.array([os.path.basename(p) for p in paths])
+    mtimes = np.array([s.st_mtime_ns for s in stats], dtype=np.int64)
+    sizes = np.array([s.st_size for s in stats], dtype=np.int64)
+    return names, mtimes, sizes
+
+class ColumnBuilder:
+    """
+    Builds the columns of detections_to_columns incrementally from timestamp
+    ordered frames, so each frame can be dropped once it is added. The
+    per-frame arrays are concatenated once by columns().
+    """
+    def __init__(self):
+        self.timestamps, self.detection_ids, self.detection_files, self.counts = [], [], [], []
+        self.obj_ids, self.positions, self.headings = [], [], []
+
+    def add_frame(self, timestamp, detection_id, path, obj_ids, positions, headings):
+        """
+        Adds a frame given as arrays (see frame_decoder.frame_values) or lists
+        of object ids, [x, y] positions and headings.
+        """
+        self.timestamps.append(timestamp)
+        self.detection_ids.append(detection_id)
+        self.detection_files.append(os.path.basename(path))
+        self.counts.append(len(obj_ids))
+        self.obj_ids.append(np.asarray(obj_ids, dtype=np.int64))
+        self.positions.append(np.asarray(positions, dtype=np.float64).reshape(-1, 2))
+        self.headings.append(np.asarray(headings, dtype=np.float64))
+
+    def add(self, detection, path):
+        objects = detection.objects()
+        self.add_frame(detection.timestamp, detection.detectionID, path, [obj.id for obj in objects], \
+                       [obj.position for obj in objects], [obj.heading for obj in objects])
+
+    def columns(self):
+        return {
+            "timestamps": np.array(self.timestamps, dtype=np.float64),
+            "detection_ids": np.array(self.detection_ids, dtype=np.int64),
+            "detection_files": np.array(self.detection_files, dtype=str),
+            "frame_offsets": np.concatenate([[0], np.cumsum(self.counts)]).astype(np.int64),
+            "obj_ids": np.concatenate(self.obj_ids or [np.zeros(0, dtype=np.int64)]),
+            "positions": np.concatenate(self.positions or [np.zeros((0, 2))]),
+            "headings": np.concatenate(self.headings or [np.zeros(0)]),
+        }
+
+def detections_to_columns(detections, paths):
+    """
+    Flattens timestamp ordered Detection objects into contiguous arrays.
+
+    Per frame: timestamps, detection_ids, detection_files and frame_offsets
+    (rows of frame i are frame_offsets[i]:frame_offsets[i+1]).
+    Per detected object (row): obj_ids, positions [R, 2], headings.
+    """
+    builder = ColumnBuilder()
+    for detection, path in zip(detections, paths):
+        builder.add(detection, path)
+    return builder.columns()
+
+def columns_in_time_range(columns, start=None, end=None):
+    """ The frames of columns with start <= timestamp <= end. """
+    timestamps = columns["timestamps"]
+    lo = 0 if start is None else np.searchsorted(timestamps, start, side="left")
+    hi = len(timestamps) if end is None else np.searchsorted(timestamps, end, side="right")
+    frame_offsets = columns["frame_offsets"]
+    rows = slice(frame_offsets[lo], frame_offsets[hi])
+    selected = {key: columns[key][lo:hi] for key in FRAME_KEYS}
+    selected["frame_offsets"] = frame_offsets[lo:hi + 1] - frame_offsets[lo]
+    for key in ROW_KEYS:
+        selected[key] = columns[key][rows]
+    return selected
+
+def filter_columns(columns, agent_ids=None, bounds=None):
+    """
+    The detections of columns of an agent in agent_ids and with a position
+    inside bounds [lower x, upper x, lower y, upper y] (None matches
+    everything). Frames left without detections are dropped.
+    """
+    keep = np.ones(len(columns["obj_ids"]), dtype=bool)
+    if agent_ids is not None:
+        keep &= np.isin(columns["obj_ids"], np.asarray(list(agent_ids), dtype=np.int64))
+    if bounds is not None:
+        x, y = columns["positions"][:, 0], columns["positions"][:, 1]
+        keep &= (x >= bounds[0]) & (x <= bounds[1]) & (y >= bounds[2]) & (y <= bounds[3])
+
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    frame_counts = np.diff(kept_before[columns["frame_offsets"]])
+    frames = frame_counts > 0
+    selected = {key: columns[key][frames] for key in FRAME_KEYS}
+    selected["frame_offsets"] = np.concatenate([[0], np.cumsum(frame_counts[frames])]).astype(np.int64)
+    for key in ROW_KEYS:
+        selected[key] = columns[key][keep]
+    return selected
+
+def save_columns(dataset_path, columns, paths):
+    names, mtimes, sizes = source_manifest(paths)
+    np.savez(cache_path(dataset_path), version=CACHE_VERSION,
+             manifest_names=names, manifest_mtimes=mtimes,
+             manifest_sizes=sizes, **columns)
+
+def map_columns(fpath):
+    """
+    Memory maps of the arrays of the .npz file at fpath, read in place from
+    its uncompressed members. None if the file is compressed or an array
+    cannot be mapped.
+    """
+    readers = {(1, 0): np.lib.format.read_array_header_1_0, (2, 0): np.lib.format.read_array_header_2_0}
+    arrays = {}
+    with open(fpath, "rb") as npz_file, zipfile.ZipFile(npz_file) as archive:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                return None
+            # the member data follows its local header (30 bytes, name, extra field)
+            npz_file.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", npz_file.read(4))
+            npz_file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(npz_file)
+            if version not in readers:
+                return None
+            shape, fortran_order, dtype = readers[version](npz_file)
+            if dtype.hasobject:
+                return None
+            name = os.path.splitext(info.filename)[0]
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(fpath, dtype=dtype, mode="r", offset=npz_file.tell(), \
+                                         shape=shape, order="F" if fortran_order else "C")
+    return arrays
+
+def read_frames(cache, frames):
+    """
+    The columns of the given (increasing) frame indices, copying only their
+    rows out of the mapped cache: one slice per run of consecutive frames.
+    """
+    offsets = np.asarray(cache["frame_offsets"])
+    starts, stops = offsets[frames], offsets[frames + 1]
+    columns = {key: np.array(cache[key][frames]) for key in FRAME_KEYS}
+    columns["frame_offsets"] = np.concatenate([[0], np.cumsum(stops - starts)]).astype(np.int64)
+    run_breaks = np.flatnonzero(np.diff(frames) != 1) + 1
+    runs = list(zip(starts[np.r_[0, run_breaks]], stops[np.r_[run_breaks - 1, len(frames) - 1]])) \
+           if len(frames) else []
+    for key in ROW_KEYS:
+        column = cache[key]
+        columns[key] = np.concatenate([column[start:stop] for start, stop in runs]) \
+                       if runs else np.array(column[:0])
+    return columns
+
+def load_columns(dataset_path, time_range=None, frame_files=None):
+    """
+    Returns the cached columns of dataset_path, or None if there is no cache
+    or it is out of date with the .json files on disk. Only the frames with
+    a timestamp in time_range (start, end) and, if frame_files is given, a
+    file name in frame_files are read (None selects every frame).
+    """
+    fpath = cache_path(dataset_path)
+    if not os.path.exists(fpath):
+        return None
+
+    cache = map_columns(fpath)
+    if cache is None:
+        with np.load(fpath) as cache:
+            cache = dict(cache)
+    if cache.pop("version") != CACHE_VERSION:
+        return None
+
+    names, mtimes, sizes = source_manifest(detection_paths(dataset_path))
+    if not (np.array_equal(names, cache.pop("manifest_names")) and \
+            np.array_equal(mtimes, cache.pop("manifest_mtimes")) and \
+            np.array_equal(sizes, cache.pop("manifest_sizes"))):
+        return None
+
+    timestamps = np.asarray(cache["timestamps"])
+    selected = np.ones(len(timestamps), dtype=bool)
+    if time_range is not None:
+        start, end = time_range
+        if start is not None:
+            selected &= timestamps >= start
+        if end is not None:
+            selected &= timestamps <= end
+    if frame_files is not None:
+        selected &= np.isin(cache["detection_files"], np.asarray(list(frame_files), dtype=str))
+    return read_frames(cache, np.flatnonzero(selected))
+
+def compile_dataset(dataset_path):
+    """
+    (Re)builds the cache of dataset_path from its .json files.
+    """
+    from ped_dataset import PedDataset
+
+    dataset = PedDataset(dataset_path=None, sequence_length=0, \
+                         observed_history=0, min_sequence_length=0)
+    dataset.dataset_path = dataset_path
+    return dataset.load_detection_columns(use_cache=False, write_cache=True)
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description='Compiles .json datasets into a columnar cache.')
+    parser.add_argument('datasets', nargs='+', help='Paths to dataset directories')
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    for dataset_path in args.datasets:
+        columns = compile_dataset(dataset_path)
+        print("Compiled {} ({} frames, {} detections)".format(
+            cache_path(dataset_path), len(columns["timestamps"]), len(columns["obj_ids"])))
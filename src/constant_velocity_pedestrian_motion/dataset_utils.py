@@ -2,6 +2,7 @@ import json
 
 
 class DetectedObject:
+    __slots__ = ("id", "position", "heading")
 
     def __init__(self, obj_id, position, heading=0):
         self.id = obj_id
@@ -20,6 +21,7 @@ class DetectedObject:
                "----------------"
 
 class Detection:
+    __slots__ = ("timestamp", "size", "object_list", "detectionID")
 
     def __init__(self, timestamp, size, object_list, detectionID):
         self.timestamp = timestamp
@@ -49,6 +51,7 @@ class Detection:
                "----------------"
 
 class Trajectory():
+    __slots__ = ("obj_id", "start_time", "positions", "headings", "timestamps")
 
     def __init__(self, obj_id, start_time,
             positions=None, headings=None, timestamps=None):
@@ -81,6 +84,8 @@ class Trajectory():
                "----------------"
 
 class Sample():
+    __slots__ = ("trajectory", "detectionID")
+
     def __init__(self, obj_id, start_time,
             positions=None, headings=None, timestamps=None, detectionID=None):
         self.trajectory = Trajectory(obj_id, start_time, positions=positions, \
@@ -163,3 +168,93 @@ class Sample():
             split_samples.append(new_sample)
 
         return split_samples
+
+class WindowSample():
+    """
+    Sample of a SampleWindows that only stores its window index. The
+    attributes of Sample are views into the window arrays, created on access.
+    """
+    __slots__ = ("windows", "index")
+
+    def __init__(self, windows, index):
+        self.windows = windows
+        self.index = index
+
+    @property
+    def _rows(self):
+        offset = self.windows.window_offsets[self.index]
+        return slice(offset, offset + self.windows.windows[self.index, 2])
+
+    @property
+    def positions(self):
+        return self.windows.positions[self._rows]
+
+    @property
+    def headings(self):
+        return self.windows.headings[self._rows]
+
+    @property
+    def timestamps(self):
+        return self.windows.timestamps[self._rows]
+
+    @property
+    def obj_id(self):
+        return self.windows.agent_ids[self.windows.windows[self.index, 0]]
+
+    @property
+    def detectionID(self):
+        # Same start time/detection ID convention as Sample.slice
+        agent, start, length = self.windows.windows[self.index]
+        return self.windows.agent_detection_ids[agent] + start
+
+    @property
+    def start_time(self):
+        agent, start, length = self.windows.windows[self.index]
+        return self.windows.timestamps[self.windows.window_offsets[self.index] - start] + start
+
+    @property
+    def trajectory(self):
+        return Trajectory(self.obj_id, self.start_time, positions=self.positions, \
+                          headings=self.headings, timestamps=self.timestamps)
+
+    def __len__(self):
+        return int(self.windows.windows[self.index, 2])
+
+    def __repr__(self):
+        return "SAMPLE OBJECT" + "\n" + \
+               "Agent ID: " + str(self.obj_id) + "\n" + \
+               "Detection ID: " + str(self.detectionID) + "\n" + \
+               "Trajectory: " + str(self.trajectory) + "\n" + \
+               "----------------"
+
+class SampleWindows():
+    """
+    Read-only sequence of the sliding-window Samples of a dataset. Samples are
+    WindowSamples created on access, so the dataset only stores contiguous
+    per-agent arrays and an integer window index.
+    """
+    def __init__(self, agent_ids, agent_detection_ids, positions, headings,
+            timestamps, windows, window_offsets):
+        self.agent_ids = agent_ids
+        self.agent_detection_ids = agent_detection_ids
+        self.positions = positions
+        self.headings = headings
+        self.timestamps = timestamps
+        self.windows = windows # (agent, start, length) per window
+        self.window_offsets = window_offsets # first row of each window
+
+    def __len__(self):
+        return len(self.windows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("sample index out of range")
+        return WindowSample(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
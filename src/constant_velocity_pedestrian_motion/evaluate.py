@@ -1,13 +1,21 @@
 import os
 import argparse
 import json
+import multiprocessing
+import cProfile
+import pstats
 
 import numpy as np
 import torch.utils.data as Data
 
+from cvm import *
 from metrics import *
 from ped_dataset import *
 from plotting import *
+import profiling
+from profiling import stage, count, timed_iter
+from result_cache import ResultCache, dataset_fingerprint, result_key, CACHE_DIR, MAX_CACHE_BYTES
+from trajectory_store import TrajectoryStore
 
 
 class RunConfig:
@@ -15,13 +23,27 @@ class RunConfig:
     min_sequence_length = 10
     observed_history = 8
     sequence_length = observed_history + prediction_horizon
+    batch_size = 4096
+    materialize = True # slice precomputed window tensors instead of collating items with a DataLoader
+    use_result_cache = True # reuse predictions/errors of earlier runs with the same config (see result_cache.py)
+    result_cache_dir = CACHE_DIR
+    result_cache_bytes = MAX_CACHE_BYTES
+    lazy = False # stream the windows (StreamingPedDataset), memory bounded by active agents x sequence_length
+    agent_timeout = 20 # with lazy, frames after which an unseen agent counts as gone (0: never, memory grows with all agents)
+    time_range = None # (start, end) timestamps to evaluate, None for all
+    agent_ids = None # ids of the agents to evaluate, None for all
+    bounds = None # [lower x, upper x, lower y, upper y] area to evaluate, None for all
 
     sample = False
     num_samples = 20
     sample_angle_std = 25
+    sample_seed = 0
 
     use_angvel = False # considers angular velocity in calculation
 
+    workers = 1 # processes for evaluating datasets/shards in parallel
+    num_shards = 1 # time range shards per dataset
+
     make_plot = False
     save_gif = False
     save_imgs = False
@@ -32,165 +54,260 @@ class RunConfig:
                      "../datasets/rightturn"]
     dataset_paths = ["../datasets/CARLA_long"]
 
-def rel_to_abs(rel_traj, start_pos):
-    rel_traj = rel_traj.permute(1, 0, 2)
-    displacement = torch.cumsum(rel_traj, dim=1)
-    start_pos = torch.unsqueeze(start_pos, dim=1)
-    abs_traj = displacement + start_pos
-    return abs_traj.permute(1, 0, 2)
+def shard_seed(sample_seed, shard):
+    """
+    Seed of the sampled rotations of a time range shard (0 when unsharded),
+    derived from sample_seed and the shard index so that every shard draws
+    its own reproducible samples.
+    """
+    return int(np.random.SeedSequence([sample_seed, shard]).generate_state(1)[0])
 
-def constant_velocity_model(observed, headings=None, sample=False,
-        from_headings=False, average_thetas=False, damping_factor=0.95):
+def evaluate_testset(testset, indices=None, shard=0):
     """
-    CVM can be run with or without sampling. A call to this function always
-    generates one sample if sample option is true.
-
-    from_headings: Use headings to generate angular velocities (otherwise use
-    past few positions)
-    average_thetas: Use average of last two theta differences (otherwise
-    extrapolate from last theta difference alone)
-    damping_factor: Discount theta by a factor of damping_factor**i on the
-    ith future timestep
+    Evaluates all windows of testset, or only those in indices (the windows
+    of time range shard, whose index seeds the sampling). Returns ADE,
+    FDE, the number of evaluated windows and, if plots are requested, the
+    trajectories per timestamp as a TrajectoryStore (otherwise None).
+    The errors (and, when plotting, the predictions) are taken from the
+    result cache if this configuration was evaluated on the same windows
+    before. Without plots no per-window tensors are kept.
+    A StreamingPedDataset is read once, without the result cache or plots.
     """
-    obs_rel = observed[1:] - observed[:-1]
-    deltas = obs_rel[-1].unsqueeze(0)
-    if RunConfig.use_angvel:
-        if from_headings:
-            dthetas = headings[1:] - headings[:-1]
-            theta1 = dthetas[-1]
-            theta2 = dthetas[-2]
-        else:
-            v1 = obs_rel[-1].unsqueeze(0)
-            v2 = obs_rel[-2].unsqueeze(0)
-            v3 = obs_rel[-3].unsqueeze(0)
-            theta1 = np.arctan2(v1[:,:,1], v1[:,:,0]) - \
-                     np.arctan2(v2[:,:,1], v2[:,:,0])
-            theta2 = np.arctan2(v2[:,:,1], v2[:,:,0]) - \
-                     np.arctan2(v3[:,:,1], v3[:,:,0])
-        if average_thetas:
-            theta = (theta1 + theta2)/2
-        else:
-            theta = theta1
-
-        # normalize to range (-pi, pi]
-        if theta > np.pi:
-            theta -= 2*np.pi
-        elif theta <= -np.pi:
-            theta += 2*np.pi
-        # rotation matrix is transposed since deltas are a row vector
-        # [x y] @ R^T = R @ [x \\ y]
-        get_rotation_mat = lambda theta: torch.Tensor(
-                [[[np.cos(theta), np.sin(theta)],
-                  [-np.sin(theta), np.cos(theta)]]])
-        y_pred_rel = [deltas @ get_rotation_mat(theta*i*(damping_factor**i))
-                for i in range(1, RunConfig.prediction_horizon+1)]
-        y_pred_rel = torch.cat(y_pred_rel, 0)
+    streaming = isinstance(testset, StreamingPedDataset)
+    timestamps = None
+    if not streaming:
+        timestamps = testset.window_timestamps(RunConfig.observed_history-1)
+        if indices is not None:
+            timestamps = timestamps[indices]
+    if streaming:
+        testset_loader = Data.DataLoader(dataset=testset, batch_size=RunConfig.batch_size)
+    elif RunConfig.materialize:
+        testset_loader = testset.batches(RunConfig.batch_size, indices)
     else:
-        y_pred_rel = deltas.repeat(RunConfig.prediction_horizon, 1, 1)
-    if sample:
-            sampled_angle = np.random.normal(0, RunConfig.sample_angle_std, 1)[0]
-            theta = (sampled_angle * np.pi)/ 180.
-            c, s = np.cos(theta), np.sin(theta)
-            rotation_mat = torch.tensor([[c, s],[-s, c]])
-            deltas = torch.t(rotation_mat.matmul(torch.t(deltas.squeeze(dim=0)))).unsqueeze(0)
-    return y_pred_rel
-
-def evaluate_testset(testset):
-    testset_loader = Data.DataLoader(dataset=testset, batch_size=1, shuffle=False)
+        if indices is not None:
+            testset = Data.Subset(testset, indices)
+        testset_loader = Data.DataLoader(dataset=testset, batch_size=RunConfig.batch_size, shuffle=False)
+    seed = shard_seed(RunConfig.sample_seed, shard)
+    generator = torch.Generator().manual_seed(seed)
+
+    collect = plots_requested() and not streaming # keep the trajectories of every window for plotting
+    cache, cached = None, None
+    if RunConfig.use_result_cache and not streaming:
+        cache = ResultCache(RunConfig.result_cache_dir, RunConfig.result_cache_bytes)
+        key = result_key(dataset_fingerprint(testset, indices), dict(vars(RunConfig), sample_seed=seed))
+        with stage("result_cache_get"):
+            cached = cache.get(key)
+        if cached is not None and collect and "predicted" not in cached:
+            cached = None # only the errors were cached, the predictions are needed
+        if cached is not None:
+            print("Using cached results")
+    batch_ades, batch_fdes = [], [] # per window errors, only kept with the trajectories
 
     with torch.no_grad():
 
-        avg_displacements =  []
-        final_displacements = []
-        ts_to_trajectories = {} # timestamp to ID for all the trajectories with that timestamp
-
-        for seq_id, (batch_x, batch_y) in enumerate(testset_loader):
-            timestamp = testset.samples[seq_id].trajectory.timestamps[RunConfig.observed_history-1]
-
-            obs_pos, obs_headings = batch_x
-            observed = obs_pos.permute(1, 0, 2)
-            history = observed.permute(1, 0, 2)
-            headings = obs_headings.permute(1, 0)
+        sum_avg_disp, sum_final_disp, num_samples = 0., 0., 0
+        ts_to_trajectories = None # timestamp to all the trajectories with that timestamp
+        if collect:
+            ts_to_trajectories = TrajectoryStore(len(timestamps), RunConfig.observed_history, \
+                    RunConfig.prediction_horizon, RunConfig.num_samples if RunConfig.sample else None)
+        elif cached is not None:
+            # the summed errors are all that is needed
+            sum_avg_disp, sum_final_disp = cached["ade_sum"], cached["fde_sum"]
+            num_samples = int(cached["windows"])
+            testset_loader = []
+
+        for batch_id, (batch_x, batch_y) in enumerate(timed_iter("collate", testset_loader)):
+            batch_start = batch_id * RunConfig.batch_size
+
+            observed, headings = batch_x
             y_true_rel, masks = batch_y
-            y_true_rel = y_true_rel.permute(1, 0, 2)
+            batch_size = len(observed)
 
+            # convert true label to absolute
+            true_positions = rel_to_abs(y_true_rel, observed[:, -1])
 
-            sample_avg_disp = []
-            sample_final_disp = []
-            samples_to_draw = RunConfig.num_samples if RunConfig.sample else 1
-            for i in range(samples_to_draw):
-
+            if cached is not None:
+                batch = slice(batch_start, batch_start + batch_size)
+                predicted_positions = cached["predicted"][batch]
+                ade, fde = cached["ade"][batch], cached["fde"][batch]
+            else:
                 # predict and convert to absolute
-                if RunConfig.use_angvel:
+                with stage("predict", batch_size=batch_size):
                     y_pred_rel = constant_velocity_model(observed, headings, \
-                            sample=RunConfig.sample)
-                else:
-                    y_pred_rel = constant_velocity_model(observed, \
-                            sample=RunConfig.sample)
-                y_pred_abs = rel_to_abs(y_pred_rel, observed[-1])
-                predicted_positions = y_pred_abs.permute(1, 0, 2)
-
-                # convert true label to absolute
-                y_true_abs = rel_to_abs(y_true_rel, observed[-1])
-                true_positions = y_true_abs.permute(1, 0, 2)
-
-                # compute errors
-                avg_displacement = avg_disp(predicted_positions, [true_positions, masks])
-                final_displacement = final_disp(predicted_positions, [true_positions, masks])
-                sample_avg_disp.append(avg_displacement)
-                sample_final_disp.append(final_displacement)
-
-                if len(RunConfig.dataset_paths) == 1:
-                    trajectories = {"observed": history, \
-                                    "predicted": predicted_positions, \
-                                    "true": true_positions, "ts": timestamp}
-
-                    if timestamp not in ts_to_trajectories.keys():
-                        ts_to_trajectories[timestamp] = []
-
-                    ts_to_trajectories[timestamp].append(trajectories)
-
-            avg_displacement = min(sample_avg_disp)
-            final_displacement = min(sample_final_disp)
-            avg_displacements.append(avg_displacement)
-            final_displacements.append(final_displacement)
-
-        print("Total:", seq_id)
-        avg_displacements = np.mean(avg_displacements)
-        final_displacements = np.mean(final_displacements)
-
-        return avg_displacements, final_displacements, ts_to_trajectories # dID_to_trajectories
+                            prediction_horizon=RunConfig.prediction_horizon, \
+                            use_angvel=RunConfig.use_angvel, sample=RunConfig.sample, \
+                            num_samples=RunConfig.num_samples, \
+                            sample_angle_std=RunConfig.sample_angle_std, \
+                            generator=generator)
+                    last_pos = observed[:, -1]
+                    if RunConfig.sample:
+                        last_pos = last_pos.unsqueeze(1)
+                    predicted_positions = rel_to_abs(y_pred_rel, last_pos)
+
+                # compute errors (min over samples when sampling)
+                with stage("metrics", batch_size=batch_size):
+                    ade = avg_disp(predicted_positions, [true_positions, masks])
+                    fde = final_disp(predicted_positions, [true_positions, masks])
+                if collect:
+                    batch_ades.append(ade)
+                    batch_fdes.append(fde)
+
+            sum_avg_disp += ade.sum()
+            sum_final_disp += fde.sum()
+
+            if ts_to_trajectories is not None:
+                with stage("collect_trajectories", batch_size=batch_size):
+                    ts_to_trajectories.add(timestamps[batch_start:batch_start + batch_size], \
+                                           observed, predicted_positions, true_positions)
+
+            num_samples += batch_size
+
+        if cache is not None and cached is None:
+            result = {"ade_sum": torch.tensor(float(sum_avg_disp), dtype=torch.float64), \
+                      "fde_sum": torch.tensor(float(sum_final_disp), dtype=torch.float64), \
+                      "windows": torch.tensor(num_samples)}
+            if collect and num_samples:
+                # the store holds the predictions in window order
+                result.update(predicted=ts_to_trajectories.predicted[:num_samples], \
+                              ade=torch.cat(batch_ades), fde=torch.cat(batch_fdes))
+            with stage("result_cache_put"):
+                cache.put(key, result)
+
+        count("windows", num_samples)
+        print("Total:", num_samples)
+        avg_displacements = float(sum_avg_disp) / max(num_samples, 1)
+        final_displacements = float(sum_final_disp) / max(num_samples, 1)
+
+        return avg_displacements, final_displacements, num_samples, ts_to_trajectories # dID_to_trajectories
+
+def plots_requested():
+    """ Whether the trajectories are needed for plotting (single dataset runs only). """
+    return len(RunConfig.dataset_paths) == 1 and \
+           bool(RunConfig.make_plot or RunConfig.save_gif or RunConfig.save_imgs)
+
+def load_dataset(dataset_path):
+    dataset_path = dataset_path.replace('~', os.environ['HOME'])
+    print("Loading dataset {}".format(dataset_path))
+    dataset_type, options = PedDataset, {}
+    if RunConfig.lazy:
+        dataset_type, options = StreamingPedDataset, {"agent_timeout": RunConfig.agent_timeout or None}
+    with stage("load_dataset", path=dataset_path):
+        dataset = dataset_type(dataset_path=dataset_path, sequence_length=RunConfig.sequence_length, observed_history=RunConfig.observed_history, \
+                              min_sequence_length=RunConfig.min_sequence_length, \
+                              time_range=RunConfig.time_range, agent_ids=RunConfig.agent_ids, bounds=RunConfig.bounds, **options)
+    return dataset
 
 def load_datasets():
     datasets = []
     datasets_size = 0
     for dataset_path in RunConfig.dataset_paths:
-        dataset_path = dataset_path.replace('~', os.environ['HOME'])
-        print("Loading dataset {}".format(dataset_path))
-        dataset = PedDataset(dataset_path=dataset_path, sequence_length=RunConfig.sequence_length, observed_history=RunConfig.observed_history, \
-                              min_sequence_length=RunConfig.min_sequence_length)
+        dataset = load_dataset(dataset_path)
         datasets.append(dataset)
-        datasets_size += len(dataset)
-    print("Size of all datasets: {}".format(datasets_size))
+        if not RunConfig.lazy: # streamed datasets are only counted while evaluating
+            datasets_size += len(dataset)
+    if not RunConfig.lazy:
+        print("Size of all datasets: {}".format(datasets_size))
     return datasets
 
+def shard_indices(testset, shard, num_shards):
+    """
+    Indices of the windows whose last observed timestamp falls into the
+    shard-th of num_shards consecutive time ranges of testset.
+    """
+    timestamps = testset.window_timestamps(RunConfig.observed_history-1)
+    shard_timestamps = np.array_split(np.unique(timestamps), num_shards)[shard]
+    return np.nonzero(np.isin(timestamps, shard_timestamps))[0]
+
+def evaluate_shard(job):
+    """
+    Loads and evaluates one time range shard of a dataset. Runs in a worker
+    process, so the RunConfig of the parent is passed along with the job.
+    """
+    config, dataset_path, shard, num_shards = job
+    for key, value in config.items():
+        setattr(RunConfig, key, value)
+    torch.set_num_threads(1)
+
+    testset = load_dataset(dataset_path)
+    indices = shard_indices(testset, shard, num_shards) if num_shards > 1 else None
+    return (testset.name,) + evaluate_testset(testset, indices, shard)
+
+def evaluate_parallel():
+    """
+    Evaluates every (dataset, shard) pair in a pool of RunConfig.workers
+    processes and merges shards weighted by their number of windows.
+    """
+    config = {key: value for key, value in vars(RunConfig).items() if not key.startswith('_')}
+    jobs = [(config, dataset_path, shard, RunConfig.num_shards) \
+            for dataset_path in RunConfig.dataset_paths for shard in range(RunConfig.num_shards)]
+    with multiprocessing.Pool(RunConfig.workers) as pool:
+        shard_results = pool.map(evaluate_shard, jobs)
+
+    testset_results = []
+    for i in range(0, len(shard_results), RunConfig.num_shards):
+        shards = shard_results[i:i + RunConfig.num_shards]
+        num_samples = sum(r[3] for r in shards)
+        avg_displacements = sum(r[1] * r[3] for r in shards) / max(num_samples, 1)
+        final_displacements = sum(r[2] * r[3] for r in shards) / max(num_samples, 1)
+        testset_results.append([shards[0][0], avg_displacements, final_displacements, num_samples])
+    ts_to_trajectories = None
+    if plots_requested():
+        ts_to_trajectories = TrajectoryStore.merge([r[4] for r in shard_results])
+    return testset_results, ts_to_trajectories
+
 def parse_commandline():
     parser = argparse.ArgumentParser(description='Runs an evaluation of the Constant Velocity Model.')
     parser.add_argument('--sample', default=RunConfig.sample, action='store_true', help='Turns on the sampling for the CVM (OUR-S).')
+    parser.add_argument('--seed', default=RunConfig.sample_seed, type=int, help='Seed for the sampled rotations.')
     parser.add_argument('--make_plot', default=RunConfig.make_plot, action="store", help='Generate plot for specified timestamp')
     parser.add_argument("--use_angvel", default=RunConfig.use_angvel, action="store_true", help="Use angular velocity in prediction if available.")
     parser.add_argument("--save_gif", default=RunConfig.save_gif, action="store", help="Save gif to fname.")
     parser.add_argument("--save_imgs", default=RunConfig.save_imgs, action="store", help="Save gif frames to dirpath.")
+    parser.add_argument("--workers", default=RunConfig.workers, type=int, help="Evaluate datasets in N processes.")
+    parser.add_argument("--shards", default=RunConfig.num_shards, type=int, help="Split each dataset into N time ranges evaluated in parallel.")
+    parser.add_argument("--no_materialize", dest="materialize", default=RunConfig.materialize, action="store_false", \
+                        help="Collate the windows item by item with a DataLoader instead of slicing precomputed tensors.")
+    parser.add_argument("--no_cache", dest="use_result_cache", default=RunConfig.use_result_cache, action="store_false", \
+                        help="Do not read or write the result cache.")
+    parser.add_argument("--lazy", default=RunConfig.lazy, action="store_true", \
+                        help="Stream the windows, keeping only the last positions of the active agents in memory.")
+    parser.add_argument("--agent_timeout", default=RunConfig.agent_timeout, type=int, \
+                        help="With --lazy, end the track of an agent unseen for N frames (0: keep every track until the end).")
+    parser.add_argument("--time_range", nargs=2, type=float, default=RunConfig.time_range, metavar=("START", "END"), \
+                        help="Only evaluate the frames with START <= timestamp <= END.")
+    parser.add_argument("--agents", nargs="+", type=int, default=RunConfig.agent_ids, help="Only evaluate the agents with these ids.")
+    parser.add_argument("--bounds", nargs=4, type=float, default=RunConfig.bounds, metavar=("XMIN", "XMAX", "YMIN", "YMAX"), \
+                        help="Only evaluate positions inside this area (e.g. a geofence from 16412_pub.py).")
+    parser.add_argument("--profile", nargs="?", const=profiling.DEFAULT_TRACE_PATH, default=None, \
+                        help="Time the pipeline stages, print a summary and write a Chrome trace to fname.")
+    parser.add_argument("--cprofile", default=None, help="Run the evaluation under cProfile and dump the stats to fname.")
     args = parser.parse_args()
+    if args.lazy and (args.shards > 1 or args.make_plot or args.save_gif or args.save_imgs):
+        parser.error("--lazy streams every dataset once and cannot be combined with --shards or plots")
     return args
 
 def main():
     args = parse_commandline()
     RunConfig.sample = args.sample
+    RunConfig.sample_seed = args.seed
     RunConfig.make_plot = float(args.make_plot)
     RunConfig.save_gif = args.save_gif
     RunConfig.save_imgs = args.save_imgs
     RunConfig.use_angvel = args.use_angvel
+    RunConfig.workers = args.workers
+    RunConfig.num_shards = args.shards
+    RunConfig.materialize = args.materialize
+    RunConfig.use_result_cache = args.use_result_cache
+    RunConfig.lazy = args.lazy
+    RunConfig.agent_timeout = args.agent_timeout
+    RunConfig.time_range = args.time_range
+    RunConfig.agent_ids = args.agents
+    RunConfig.bounds = args.bounds
+    if args.profile:
+        profiling.enable(args.profile)
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
     if RunConfig.sample:
         print("Sampling activated.")
     if RunConfig.make_plot != False:
@@ -204,33 +321,54 @@ def main():
 
     print("--------------------------")
 
-    datasets = load_datasets()
-    testset_results = []
-    for i, testset in enumerate(datasets):
-        print("Evaluating testset {}".format(testset.name))
-        avg_displacements, final_displacements, ts_to_trajectories = evaluate_testset(testset)
-        testset_results.append([testset.name, avg_displacements, final_displacements])
+    if RunConfig.workers > 1 or RunConfig.num_shards > 1:
+        print("Evaluating in {} processes, {} shard(s) per dataset.".format(RunConfig.workers, RunConfig.num_shards))
+        testset_results, ts_to_trajectories = evaluate_parallel()
+    else:
+        datasets = load_datasets()
+        testset_results = []
+        for i, testset in enumerate(datasets):
+            print("Evaluating testset {}".format(testset.name))
+            avg_displacements, final_displacements, num_samples, ts_to_trajectories = evaluate_testset(testset)
+            testset_results.append([testset.name, avg_displacements, final_displacements, num_samples])
+
+    if args.cprofile:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+        print("\n== cProfile (top 15 by cumulative time, full stats in {}) ==".format(args.cprofile))
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
 
     print("\n== Results for testset evaluations ==")
-    total_avg_disp, total_final_disp = 0, 0
-    for name, avg_displacements, final_displacements in testset_results:
+    total_avg_disp, total_final_disp, total_samples = 0, 0, 0
+    for name, avg_displacements, final_displacements, num_samples in testset_results:
         print("- Testset: {}".format(name))
+        if num_samples == 0:
+            print("No windows matched, skipped")
+            continue
         print("ADE: {}".format(avg_displacements))
         print("FDE: {}".format(final_displacements))
-        total_avg_disp += avg_displacements
-        total_final_disp += final_displacements
+        total_avg_disp += num_samples * avg_displacements
+        total_final_disp += num_samples * final_displacements
+        total_samples += num_samples
+    if total_samples == 0:
+        print("No windows matched in any testset")
+        return
+    # Weighted by the number of samples in each testset
     print("- Average")
-    print("*ADE: {}".format(total_avg_disp/len(testset_results)))
-    print("*FDE: {}".format(total_final_disp/len(testset_results)))
+    print("*ADE: {}".format(total_avg_disp/total_samples))
+    print("*FDE: {}".format(total_final_disp/total_samples))
 
     if len(RunConfig.dataset_paths) == 1:
+        geofence = load_dataset_info(RunConfig.dataset_paths[0]).get('geofence')
         if RunConfig.make_plot:
             trajectories = ts_to_trajectories[RunConfig.make_plot]
-            plotting(trajectories)
+            with stage("plot"):
+                plotting(trajectories, geofence)
 
         if RunConfig.save_gif:
             trajectories = [ts_to_trajectories[i] for i in sorted(ts_to_trajectories.keys())]
-            plotting_gif(trajectories, RunConfig.save_gif)
+            with stage("save_gif", frames=len(trajectories)):
+                plotting_gif(trajectories, RunConfig.save_gif, geofence)
 
         if RunConfig.save_imgs != False:
             trajectories = [ts_to_trajectories[i] for i in sorted(ts_to_trajectories.keys())]
@@ -239,7 +377,8 @@ def main():
                 os.mkdir(RunConfig.save_imgs)
             except:
                 pass
-            plotting_saveimgs(trajectories, RunConfig.save_imgs)
+            with stage("save_imgs", frames=len(trajectories)):
+                plotting_saveimgs(trajectories, RunConfig.save_imgs, geofence)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,119 @@
+"""
+16.412 Intent Inference GC | frame_decoder.py
+Decodes detection frame .json files straight into NumPy arrays of ids,
+positions and headings, sized from the number of objects in the frame (and
+concatenated by dataset_cache.ColumnBuilder), without building a
+DetectedObject or intermediate lists per agent. The JSON
+parser is pluggable: the fastest installed of orjson and ujson is used, with
+the stdlib json module as fallback.
+
+Compare the decoding paths on a dataset with
+    python frame_decoder.py data/ucy_univ
+"""
+import os
+import glob
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+
+BACKENDS = {"json": json.loads}
+try:
+    import orjson
+    BACKENDS["orjson"] = orjson.loads
+except ImportError:
+    pass
+try:
+    import ujson
+    BACKENDS["ujson"] = ujson.loads
+except ImportError:
+    pass
+
+# Fastest available backend first
+DEFAULT_BACKEND = next(name for name in ("orjson", "ujson", "json") if name in BACKENDS)
+
+
+def get_loads(backend=None):
+    """ JSON loads function of backend (default: the fastest available). """
+    return BACKENDS[backend or DEFAULT_BACKEND]
+
+def read_json(path, backend=None):
+    with open(path, 'rb') as json_file:
+        return get_loads(backend)(json_file.read())
+
+def frame_values(frame_json):
+    """
+    timestamp, ids [n], positions [n, 2] and headings [n] arrays of a decoded
+    frame of n objects. As in DetectedObject.from_json, the heading is only
+    used when the frame has angular velocities and is 0 otherwise.
+    """
+    objects = frame_json['object_list']
+    n = len(objects)
+    ids = np.fromiter((obj['id'] for obj in objects), dtype=np.int64, count=n)
+    positions = np.fromiter(itertools.chain.from_iterable(obj['position'] for obj in objects), \
+                            dtype=np.float64, count=2*n).reshape(n, 2)
+    headings = np.fromiter((obj['heading'] if 'angular velocity' in obj else 0 for obj in objects), \
+                           dtype=np.float64, count=n)
+    return frame_json['timestamp'], ids, positions, headings
+
+def decode_frame(path, backend=None):
+    """ frame_values of the frame file at path. """
+    return frame_values(read_json(path, backend))
+
+def benchmark(dataset_path, repeats=3):
+    """
+    Seconds to turn all frames of dataset_path into dataset columns, through
+    Detection objects (the original path) and directly, for every backend.
+    Files are read into memory first so only decoding is timed.
+    """
+    from dataset_utils import Detection
+    from dataset_cache import ColumnBuilder
+
+    paths = glob.glob(os.path.join(dataset_path, 'data', '*.json'))
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as json_file:
+            contents.append(json_file.read())
+
+    def objects_pass(loads):
+        builder = ColumnBuilder()
+        for content, path in zip(contents, paths):
+            builder.add(Detection.from_json(loads(content), ID=0), path)
+        return builder.columns()
+
+    def direct_pass(loads):
+        builder = ColumnBuilder()
+        for content, path in zip(contents, paths):
+            timestamp, ids, positions, headings = frame_values(loads(content))
+            builder.add_frame(timestamp, 0, path, ids, positions, headings)
+        return builder.columns()
+
+    def time_pass(fn, loads):
+        start = time.perf_counter()
+        for i in range(repeats):
+            fn(loads)
+        return (time.perf_counter() - start) / repeats
+
+    results = {}
+    for name, loads in BACKENDS.items():
+        results[name + "+objects"] = time_pass(objects_pass, loads)
+        results[name + "+direct"] = time_pass(direct_pass, loads)
+    return len(contents), results
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description='Benchmarks decoding of detection frames.')
+    parser.add_argument('dataset', nargs='?', default='data/ucy_univ', help='Path to a dataset directory')
+    parser.add_argument('--repeats', default=3, type=int, help='Passes over the dataset per path.')
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    num_frames, results = benchmark(args.dataset, args.repeats)
+    baseline = results["json+objects"]
+    print("{} frames of {}, default backend: {}".format(num_frames, args.dataset, DEFAULT_BACKEND))
+    for name, seconds in sorted(results.items(), key=lambda r: r[1]):
+        print("{:<16s} {:8.2f} ms {:10.1f} us/frame {:6.2f}x".format( \
+              name, 1000 * seconds, 1e6 * seconds / num_frames, baseline / seconds))
@@ -0,0 +1,129 @@
+"""
+16.412 Intent Inference GC | frame_index.py
+Timestamp index of the per-frame .json files of a dataset, so that ordering
+the frames and selecting a time range does not require opening every file.
+The index (frame_index.json in the dataset directory) lists the file name,
+timestamp, byte size, number of agents and mtime of every frame in timestamp
+order, plus the ids and bounding box of the agents in each frame so agent
+and area queries can skip frames as well. It is written by parse_data.py and
+otherwise generated on first use, and is rebuilt whenever the frame files no
+longer match it.
+
+Build indices ahead of time with
+    python frame_index.py path_to_dataset [path_to_dataset ...]
+"""
+import os
+import glob
+import json
+import bisect
+import argparse
+
+from frame_decoder import read_json
+
+INDEX_FNAME = "frame_index.json"
+INDEX_VERSION = 2
+
+
+def index_path(dataset_path):
+    return os.path.join(dataset_path, INDEX_FNAME)
+
+def frame_entry(frame_path, frame_json):
+    """
+    Index entry of a frame file (frame_json is its content), with its
+    current size and mtime. bounds is [lower x, upper x, lower y, upper y]
+    of the agent positions, None for an empty frame.
+    """
+    stat = os.stat(frame_path)
+    objects = frame_json['object_list']
+    xs = [obj['position'][0] for obj in objects]
+    ys = [obj['position'][1] for obj in objects]
+    return {"file": os.path.basename(frame_path), "timestamp": frame_json['timestamp'],
+            "size": stat.st_size, "agents": len(objects), "mtime": stat.st_mtime_ns,
+            "ids": sorted(obj['id'] for obj in objects),
+            "bounds": [min(xs), max(xs), min(ys), max(ys)] if objects else None}
+
+def write_index(dataset_path, frames):
+    frames = sorted(frames, key=lambda frame: (frame["timestamp"], frame["file"]))
+    with open(index_path(dataset_path), "w") as index_file:
+        json.dump({"version": INDEX_VERSION, "frames": frames}, index_file)
+    return frames
+
+def build_index(dataset_path):
+    """ (Re)builds the index of dataset_path by parsing every frame file. """
+    frames = []
+    for frame_path in glob.glob(os.path.join(dataset_path, 'data', '*.json')):
+        frames.append(frame_entry(frame_path, read_json(frame_path)))
+    return write_index(dataset_path, frames)
+
+def load_index(dataset_path):
+    """
+    Returns the indexed frames of dataset_path in timestamp order, or None if
+    there is no index or a frame file was added, removed or modified since
+    it was written.
+    """
+    fpath = index_path(dataset_path)
+    if not os.path.exists(fpath):
+        return None
+    index = read_json(fpath)
+    if index.get("version") != INDEX_VERSION:
+        return None
+
+    frames = index["frames"]
+    data_path = os.path.join(dataset_path, 'data')
+    if len(frames) != len(glob.glob(os.path.join(data_path, '*.json'))):
+        return None
+    for frame in frames:
+        try:
+            stat = os.stat(os.path.join(data_path, frame["file"]))
+        except OSError:
+            return None
+        if stat.st_mtime_ns != frame["mtime"] or stat.st_size != frame["size"]:
+            return None
+    return frames
+
+def ordered_frames(dataset_path):
+    """ Indexed frames of dataset_path in timestamp order. """
+    frames = load_index(dataset_path)
+    if frames is None:
+        frames = build_index(dataset_path)
+    return frames
+
+def select_time_range(frames, start=None, end=None):
+    """ The timestamp ordered frames with start <= timestamp <= end. """
+    timestamps = [frame["timestamp"] for frame in frames]
+    lo = 0 if start is None else bisect.bisect_left(timestamps, start)
+    hi = len(frames) if end is None else bisect.bisect_right(timestamps, end)
+    return frames[lo:hi]
+
+def bounds_overlap(a, b):
+    """ Whether two [lower x, upper x, lower y, upper y] boxes intersect. """
+    return a[0] <= b[1] and b[0] <= a[1] and a[2] <= b[3] and b[2] <= a[3]
+
+def select_frames(frames, time_range=None, agent_ids=None, bounds=None):
+    """
+    The timestamp ordered frames that can contain detections matching the
+    query: timestamp in time_range (start, end), an agent in agent_ids and a
+    position inside bounds [lower x, upper x, lower y, upper y]. None
+    matches everything.
+    """
+    if time_range is not None:
+        frames = select_time_range(frames, *time_range)
+    if agent_ids is not None:
+        agent_ids = set(agent_ids)
+        frames = [frame for frame in frames if not agent_ids.isdisjoint(frame["ids"])]
+    if bounds is not None:
+        frames = [frame for frame in frames \
+                  if frame["bounds"] is not None and bounds_overlap(frame["bounds"], bounds)]
+    return frames
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description='Builds the timestamp index of .json datasets.')
+    parser.add_argument('datasets', nargs='+', help='Paths to dataset directories')
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    for dataset_path in args.datasets:
+        frames = build_index(dataset_path)
+        print("Indexed {} ({} frames)".format(index_path(dataset_path), len(frames)))
@@ -0,0 +1,303 @@
+"""
+16.412 Intent Inference GC | intent.py
+Intersection intent inference (straight / left / right) on top of the CVM.
+Route templates are learned from the complete agent tracks of recorded
+datasets (e.g. CARLA_long, recorded inside the geofence of 16412_pub.py):
+every track is resampled to a fixed number of points and labelled by its
+overall turn, and near-duplicate routes are merged. The observed history plus
+CVM prediction of every agent is then scored against all routes at once,
+through a distance grid precomputed around the routes, and the per-intent
+route costs are turned into probabilities.
+
+Accuracy and latency report on the turn datasets:
+    python intent.py --train ../datasets/CARLA_long \\
+        --test ../datasets/leftturn ../datasets/rightturn ../datasets/CARLA_short
+"""
+import time
+import argparse
+
+import numpy as np
+import torch
+
+from cvm import constant_velocity_model, rel_to_abs
+from ped_dataset import PedDataset
+
+INTENTS = ["straight", "left", "right"]
+STRAIGHT, LEFT, RIGHT = range(3)
+
+# Sign of the turn angle of a left turn. The CARLA world frame is left-handed
+# (y points down on the map), so left turns are clockwise in x/y, as in the
+# leftturn dataset.
+LEFT_SIGN = -1
+
+
+def resample_path(points, num_points):
+    """ num_points points evenly spaced by arclength along a [n, 2] polyline. """
+    points = np.asarray(points, dtype=np.float64)
+    arclength = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))])
+    targets = np.linspace(0, arclength[-1], num_points)
+    return np.stack([np.interp(targets, arclength, points[:, 0]), \
+                     np.interp(targets, arclength, points[:, 1])], axis=1)
+
+def turn_angle(path):
+    """ Signed angle (radians) between the first and last direction of a resampled path. """
+    start, end = path[1] - path[0], path[-1] - path[-2]
+    angle = np.arctan2(end[1], end[0]) - np.arctan2(start[1], start[0])
+    return (angle + np.pi) % (2*np.pi) - np.pi
+
+def path_intent(path, threshold=np.radians(45), left_sign=LEFT_SIGN):
+    """ Intent index of a path from its turn angle. """
+    angle = left_sign * turn_angle(path)
+    if angle > threshold:
+        return LEFT
+    if angle < -threshold:
+        return RIGHT
+    return STRAIGHT
+
+def border_distance(point, fence):
+    """ Distance of a point inside fence [lower x, upper x, lower y, upper y] to its border. """
+    return min(point[0] - fence[0], fence[1] - point[0], point[1] - fence[2], fence[3] - point[1])
+
+def learn_routes(datasets, num_points=32, edge=8., min_length=20., merge_distance=5., left_sign=LEFT_SIGN):
+    """
+    Route templates from the agent tracks of datasets (PedDatasets). Only
+    complete tracks are used: ones that enter and leave the recorded area
+    within edge meters of its geofence (or of the bounding box of all
+    positions) and are at least min_length meters long. Agents that appear or
+    disappear inside the intersection would otherwise add the straight tails
+    of turns as routes. A track is merged into an earlier route with the same
+    intent whose start and end are within merge_distance. Returns routes
+    [R, num_points, 2] and their intents [R].
+    """
+    routes, intents = [], []
+    for dataset in datasets:
+        fence = dataset.geofence
+        if fence is None:
+            lower, upper = dataset.positions.min(0), dataset.positions.max(0)
+            fence = [lower[0], upper[0], lower[1], upper[1]]
+        for track in dataset.agent_tracks():
+            if len(track) < 2 or np.linalg.norm(np.diff(track, axis=0), axis=1).sum() < min_length or \
+               border_distance(track[0], fence) > edge or border_distance(track[-1], fence) > edge:
+                continue
+            path = resample_path(track, num_points)
+            intent = path_intent(path, left_sign=left_sign)
+            duplicate = any(intent == other_intent and \
+                            np.linalg.norm(path[0] - other[0]) < merge_distance and \
+                            np.linalg.norm(path[-1] - other[-1]) < merge_distance \
+                            for other, other_intent in zip(routes, intents))
+            if not duplicate:
+                routes.append(path)
+                intents.append(intent)
+    return torch.tensor(np.array(routes), dtype=torch.float32), torch.tensor(intents, dtype=torch.long)
+
+def segment_distances(points, routes):
+    """
+    Distance of every point [C, 2] to every route polyline [R, M, 2], and the
+    arclength along the route of the closest route position. Returns two
+    [C, R] tensors.
+    """
+    starts, ends = routes[:, :-1], routes[:, 1:] # [R, M-1, 2]
+    segments = ends - starts
+    lengths = segments.norm(dim=-1)
+    offsets = torch.cumsum(lengths, dim=1) - lengths # arclength at the segment starts
+    rel = points[:, None, None] - starts # [C, R, M-1, 2]
+    t = ((rel * segments).sum(-1) / lengths.clamp_min(1e-9)**2).clamp(0, 1)
+    dists = (rel - t.unsqueeze(-1) * segments).norm(dim=-1)
+    dist, segment = dists.min(-1)
+    progress = offsets.gather(1, segment.T).T + t.gather(2, segment.unsqueeze(-1)).squeeze(-1) * lengths.gather(1, segment.T).T
+    return dist, progress
+
+class IntentClassifier:
+    """
+    Scores trajectories against route templates. The cost of a route is the
+    mean distance of the trajectory points to the route, with predicted
+    points weighted by prediction_weight relative to observed ones (the CVM
+    keeps going straight into a turn); a route traversed
+    backwards (the closest route position of the last point is more than
+    progress_tolerance meters before that of the first) is excluded. The cost
+    of an intent is that of its best route and probabilities are a softmax of
+    -cost / scale.
+
+    With a resolution (meters), the distance and closest route position of
+    every route are precomputed on a grid around the routes, so scoring is a
+    table lookup per trajectory point. Without, distances to all route points
+    are computed for every trajectory (exact up to the route sampling).
+    """
+
+    def __init__(self, routes, route_intents, scale=0.5, prediction_weight=0.25, resolution=0.5, margin=10., \
+                 progress_tolerance=1., chunk_size=2048):
+        self.routes = routes # [R, M, 2]
+        self.route_intents = route_intents # [R]
+        self.scale = scale
+        self.prediction_weight = prediction_weight
+        self.progress_tolerance = progress_tolerance
+        self.chunk_size = chunk_size # trajectories per exact distance computation
+        self.intent_routes = torch.stack([route_intents == i for i in range(len(INTENTS))]) # [3, R]
+        self.resolution = resolution
+        if resolution is not None:
+            self.build_grid(resolution, margin)
+
+    @classmethod
+    def from_datasets(cls, dataset_paths, num_points=32, **kwargs):
+        datasets = [PedDataset(path, sequence_length=1, observed_history=1, min_sequence_length=1) \
+                    for path in dataset_paths]
+        return cls(*learn_routes(datasets, num_points), **kwargs)
+
+    def build_grid(self, resolution, margin):
+        """ Distance and progress [H*W, R] of the grid cell centers to every route. """
+        points = self.routes.reshape(-1, 2)
+        self.grid_origin = points.min(0)[0] - margin
+        upper = points.max(0)[0] + margin
+        self.grid_shape = ((upper - self.grid_origin) / resolution).ceil().long() + 1 # [W, H]
+        xs = self.grid_origin[0] + resolution * torch.arange(int(self.grid_shape[0]))
+        ys = self.grid_origin[1] + resolution * torch.arange(int(self.grid_shape[1]))
+        cells = torch.stack(torch.meshgrid(ys, xs, indexing="ij")[::-1], dim=-1).reshape(-1, 2)
+        fields = [segment_distances(chunk, self.routes) for chunk in torch.split(cells, 4096)]
+        self.grid_distance = torch.cat([dist for dist, _ in fields])
+        self.grid_progress = torch.cat([progress for _, progress in fields])
+
+    def point_distances(self, paths):
+        """ paths: [N, P, 2]. Distance and progress [N, P, R] of every point to every route. """
+        if self.resolution is None:
+            return self._exact_distances(paths)
+        cell = ((paths - self.grid_origin) / self.resolution).round().long()
+        cell = torch.minimum(cell.clamp_min(0), self.grid_shape - 1)
+        flat = (cell[..., 1] * self.grid_shape[0] + cell[..., 0]).reshape(-1)
+        # points outside the grid are charged their distance to it on top
+        outside = (paths - self.grid_origin - self.resolution * cell).norm(dim=-1, keepdim=True)
+        outside = outside * (outside > self.resolution)
+        dist = self.grid_distance[flat].view(*paths.shape[:2], -1) + outside
+        return dist, self.grid_progress[flat].view(*paths.shape[:2], -1)
+
+    def _exact_distances(self, paths):
+        num_routes, num_points = self.routes.shape[:2]
+        route_points = self.routes.reshape(-1, 2)
+        spacing = (self.routes[:, 1] - self.routes[:, 0]).norm(dim=-1) # routes are resampled evenly
+        dists, progress = [], []
+        for chunk in torch.split(paths, self.chunk_size):
+            # [n, P, R, M] distances of every path point to every route point
+            chunk_dists = torch.cdist(chunk, route_points.expand(len(chunk), -1, -1))
+            nearest, nearest_idx = chunk_dists.view(*chunk.shape[:2], num_routes, num_points).min(-1)
+            dists.append(nearest)
+            progress.append(nearest_idx * spacing)
+        return torch.cat(dists), torch.cat(progress)
+
+    def route_costs(self, paths, num_observed=None):
+        """
+        paths: [N, P, 2] absolute positions, of which the first num_observed
+        are observed (all if None). Returns [N, R] route costs.
+        """
+        dist, progress = self.point_distances(paths)
+        weights = torch.ones(paths.shape[1])
+        if num_observed is not None:
+            weights[num_observed:] = self.prediction_weight
+        cost = torch.einsum("npr,p->nr", dist, weights / weights.sum())
+        backwards = progress[:, -1] < progress[:, 0] - self.progress_tolerance
+        return cost.masked_fill(backwards, float("inf"))
+
+    def predict_proba(self, paths, num_observed=None):
+        """ paths: [N, P, 2] (see route_costs). Returns [N, 3] probabilities of INTENTS. """
+        costs = self.route_costs(paths, num_observed)
+        intent_costs = costs.unsqueeze(1).masked_fill(~self.intent_routes, float("inf")).min(-1)[0]
+        logits = -intent_costs / self.scale
+        # agents far from every route (or with no valid route) are uniform
+        logits = torch.where(torch.isinf(logits).all(1, keepdim=True), torch.zeros_like(logits), logits)
+        return torch.softmax(logits, dim=1)
+
+    def predict(self, observed, headings=None, prediction_horizon=9, use_angvel=True):
+        """
+        Intent probabilities [N, 3] from observed positions [N, obs, 2]:
+        the observed history is extended by the CVM prediction and scored.
+        """
+        y_pred_rel = constant_velocity_model(observed, headings, prediction_horizon=prediction_horizon, \
+                                             use_angvel=use_angvel)
+        predicted = rel_to_abs(y_pred_rel, observed[:, -1])
+        return self.predict_proba(torch.cat([observed, predicted], dim=1), observed.shape[1])
+
+    def frame_intents(self, predictor):
+        """ (obj_ids, intent probabilities [N, 3]) of the agents of an online predictor.Predictor. """
+        obj_ids, positions, headings = predictor.histories()
+        with torch.no_grad():
+            probs = self.predict(torch.from_numpy(positions), torch.from_numpy(headings), \
+                                 predictor.prediction_horizon, predictor.use_angvel)
+        return obj_ids, probs
+
+def window_labels(dataset, left_sign=LEFT_SIGN):
+    """ Intent of every window of dataset: the overall turn of its agent's track. """
+    track_intents = np.array([path_intent(resample_path(track, 32), left_sign=left_sign) \
+                              if len(track) > 1 else STRAIGHT for track in dataset.agent_tracks()])
+    return torch.from_numpy(track_intents[dataset.windows[:, 0]])
+
+def evaluate(classifier, dataset_paths, observed_history=8, prediction_horizon=9, use_angvel=True, confidence=0.8):
+    """
+    Scores of classifier on all windows of dataset_paths: accuracy, mean
+    probability of the true intent, and the accuracy and share (coverage) of
+    the windows whose most likely intent has at least confidence. Agents
+    waiting on an approach shared by several routes cannot be told apart, so
+    the last two show how reliable the classifier is once it commits.
+    """
+    probs, labels = [], []
+    for path in dataset_paths:
+        dataset = PedDataset(path, sequence_length=observed_history + prediction_horizon, \
+                             observed_history=observed_history, min_sequence_length=observed_history + 1)
+        observed, headings, _, _ = dataset.materialize()
+        with torch.no_grad():
+            probs.append(classifier.predict(observed, headings, prediction_horizon, use_angvel))
+        labels.append(window_labels(dataset))
+    probs, labels = torch.cat(probs), torch.cat(labels)
+    best, predicted = probs.max(1)
+    correct = (predicted == labels).double()
+    confident = best >= confidence
+    return {"windows": len(labels), "accuracy": correct.mean().item(), \
+            "p_true": probs.gather(1, labels.unsqueeze(1)).mean().item(), \
+            "confident_accuracy": correct[confident].mean().item() if confident.any() else float("nan"), \
+            "coverage": confident.double().mean().item()}
+
+def latency(classifier, num_agents, observed_history=8, prediction_horizon=9, repeats=10):
+    """ Seconds per predict() call for one frame of num_agents agents. """
+    # agents placed along random routes, so the costs are realistic
+    routes = torch.tensor(np.array([resample_path(route, 64) for route in classifier.routes.numpy()]), \
+                          dtype=torch.float32)
+    generator = torch.Generator().manual_seed(0)
+    route = torch.randint(len(routes), (num_agents,), generator=generator)
+    start = torch.randint(routes.shape[1] - observed_history, (num_agents,), generator=generator)
+    steps = start.unsqueeze(1) + torch.arange(observed_history)
+    observed = routes[route.unsqueeze(1), steps] + 0.1 * torch.randn(num_agents, observed_history, 2, generator=generator)
+    with torch.no_grad():
+        classifier.predict(observed, prediction_horizon=prediction_horizon) # warm up
+        begin = time.perf_counter()
+        for i in range(repeats):
+            classifier.predict(observed, prediction_horizon=prediction_horizon)
+    return (time.perf_counter() - begin) / repeats
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description='Accuracy and latency of the route template intent classifier.')
+    parser.add_argument('--train', nargs='+', default=['../datasets/CARLA_long'], help='Datasets to learn routes from.')
+    parser.add_argument('--test', nargs='+', default=['../datasets/leftturn', '../datasets/rightturn', '../datasets/CARLA_short'], \
+                        help='Datasets to evaluate on.')
+    parser.add_argument('--points', nargs='+', type=int, default=[16, 32, 64], help='Route template resolutions.')
+    parser.add_argument('--resolutions', nargs='+', type=float, default=[0, 1, 0.5, 0.25], \
+                        help='Distance grid cell sizes in meters (0: exact distances).')
+    parser.add_argument('--agents', nargs='+', type=int, default=[100, 1000, 5000], help='Agents per frame for the latency.')
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    torch.set_grad_enabled(False)
+    print("{:>6s} {:>6s} {:>6s} {:<12s} {:>7s} {:>8s} {:>7s} {:>10s} {:>8s}".format( \
+          "points", "routes", "grid", "test", "windows", "accuracy", "p(true)", "confident", "coverage") + \
+          "".join(" {:>12s}".format("{} agents".format(n)) for n in args.agents))
+    for num_points in args.points:
+        for resolution in args.resolutions:
+            classifier = IntentClassifier.from_datasets(args.train, num_points, resolution=resolution or None)
+            config = "{:>6d} {:>6d} {:>6s}".format(num_points, len(classifier.routes), \
+                                                  "{:.2f}".format(resolution) if resolution else "exact")
+            latencies = "".join(" {:>9.2f} ms".format(1000 * latency(classifier, num_agents)) \
+                                for num_agents in args.agents)
+            for path in args.test:
+                scores = evaluate(classifier, [path])
+                print("{} {:<12s} {:>7d} {:>8.3f} {:>7.3f} {:>10.3f} {:>8.3f}".format( \
+                      config, path.rstrip("/").split("/")[-1][:12], scores["windows"], scores["accuracy"], \
+                      scores["p_true"], scores["confident_accuracy"], scores["coverage"]) + latencies)
+                latencies = ""
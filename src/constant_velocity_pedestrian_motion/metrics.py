@@ -1,31 +1,80 @@
+import time
+import argparse
+
 import torch
 
 
+def _l2_dists(y_pred, y_true, masks):
+    """
+    Masked per-step L2 distances. y_pred is either [N, horizon, 2] or, for
+    sampled predictions, [N, K, horizon, 2]; the result has the same leading
+    dimensions without the coordinate axis.
+    """
+    if y_pred.dim() == 4:
+        y_true, masks = y_true.unsqueeze(1), masks.unsqueeze(1)
+    squared_dist = (y_true - y_pred)**2
+    return masks * torch.sqrt(squared_dist.sum(-1))
+
+def _min_over_samples(disps):
+    """ Best of K for sampled predictions ([N, K] -> [N]). """
+    if disps.dim() == 2:
+        disps = disps.min(1)[0]
+    return disps
+
 def avg_disp(y_pred, y_true):
-    """ Average displacement error. """
+    """
+    Average displacement error of every trajectory in the batch ([N] tensor,
+    best of K for sampled predictions).
+    """
     y_true, masks = y_true
 
     seq_lengths = masks.sum(1)
-    batch_size = len(seq_lengths)
 
-    squared_dist = (y_true - y_pred)**2
-    l2_dist = masks * torch.sqrt(squared_dist.sum(2))
+    l2_dist = _l2_dists(y_pred, y_true, masks)
+    if l2_dist.dim() == 3:
+        seq_lengths = seq_lengths.unsqueeze(1)
 
-    avg_l2_dist = (1./batch_size) * ((1./seq_lengths) * l2_dist.sum(1)).sum()
-    return avg_l2_dist.item()
+    return _min_over_samples(l2_dist.sum(-1) / seq_lengths)
 
 
 def final_disp(y_pred, y_true):
-    """ Final displacement error """
+    """
+    Final displacement error (at the last valid step) of every trajectory in
+    the batch ([N] tensor, best of K for sampled predictions).
+    """
     y_true, masks = y_true
 
-    seq_lengths = masks.sum(1).type(torch.LongTensor) - 1
-    batch_size = len(seq_lengths)
+    last_idxs = (masks.sum(1).long() - 1).clamp(min=0)
 
-    squared_dist = (y_true - y_pred)**2
-    l2_dists = masks * torch.sqrt(squared_dist.sum(2))
+    l2_dists = _l2_dists(y_pred, y_true, masks)
+
+    # gather the last valid step of each row
+    last_idxs = last_idxs.view(-1, *([1] * (l2_dists.dim() - 1)))
+    last_idxs = last_idxs.expand(*l2_dists.shape[:-1], 1)
+    return _min_over_samples(l2_dists.gather(-1, last_idxs).squeeze(-1))
 
-    disp_sum = l2_dists[:, seq_lengths].sum()
-    avg_final_l2_disp = (1./batch_size) * disp_sum
+def benchmark(num_trajectories=100000, prediction_horizon=9, num_samples=20, repeats=5):
+    """
+    Seconds per avg_disp + final_disp call on random masked batches, without
+    and with K sampled predictions.
+    """
+    y_true = torch.randn(num_trajectories, prediction_horizon, 2)
+    lengths = torch.randint(1, prediction_horizon + 1, (num_trajectories, 1))
+    masks = (torch.arange(prediction_horizon) < lengths).double()
+    results = {}
+    for name, shape in [("single", (num_trajectories, prediction_horizon, 2)), \
+                        ("sampled", (num_trajectories, num_samples, prediction_horizon, 2))]:
+        y_pred = torch.randn(*shape)
+        start = time.perf_counter()
+        for i in range(repeats):
+            ade = avg_disp(y_pred, [y_true, masks]).mean()
+            fde = final_disp(y_pred, [y_true, masks]).mean()
+        results[name] = (time.perf_counter() - start) / repeats
+    return results
 
-    return avg_final_l2_disp.item()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks the ADE/FDE metrics.')
+    parser.add_argument('-n', default=100000, type=int, help='Number of trajectories.')
+    args = parser.parse_args()
+    for name, seconds in benchmark(args.n).items():
+        print("{}: {:.2f} ms for {} trajectories".format(name, 1000 * seconds, args.n))
@@ -1,143 +1,412 @@
 import os
 import sys
-import copy
-import glob
 import json
+from collections import deque
 
 import numpy as np
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset
 
 from dataset_utils import *
+from dataset_cache import ColumnBuilder, load_columns, save_columns, \
+                          columns_in_time_range, filter_columns, cache_path, detection_paths
+from frame_index import ordered_frames, select_frames, load_index
+from frame_decoder import read_json, decode_frame
+from profiling import profiled, stage, count
 
 
 class PedDataset(Dataset):
     """
     Datset of pedestrian trajectories.
     """
-    def __init__(self, dataset_path, sequence_length, observed_history, min_sequence_length):
+    def __init__(self, dataset_path, sequence_length, observed_history, min_sequence_length,
+                 use_cache=True, time_range=None, agent_ids=None, bounds=None):
         super(PedDataset, self).__init__()
         self.dataset_path = dataset_path
+        self.use_cache = use_cache # read/write the columnar dataset_cache.npz
+        # Query: only detections with timestamp in time_range (start, end), of
+        # agents in agent_ids and inside bounds [lower x, upper x, lower y,
+        # upper y]; None matches everything
+        self.time_range = time_range
+        self.query_agent_ids = agent_ids
+        self.bounds = bounds
         self.sequence_length = sequence_length
         self.min_sequence_length = min_sequence_length
         self.observed_history = observed_history
 
         self.detection_timestamps, self.detection_paths = None, None
-        self.detections = None
         self.name = None
+        self.geofence = None
         self.samples = []
         self.size = 0
+        self.tensors = None # all windows as [observed_pos, observed_headings, y_delta, mask], see materialize
 
         if self.dataset_path is not None:
             self.initialize_dataset()
 
     def initialize_dataset(self):
-        data_path_expanded = os.path.join(self.dataset_path, 'data', '*.json')
-        detection_paths = glob.glob(data_path_expanded)
-        assert(len(detection_paths) > 0)
-        self.detection_timestamps, self.detection_paths = self._ordered_timestamp_detection_paths(detection_paths)
+        columns = self.load_detection_columns(use_cache=self.use_cache, write_cache=self.use_cache)
+        self.detection_timestamps = columns["timestamps"].tolist()
+        self.detection_paths = [os.path.join(self.dataset_path, 'data', fname) \
+                                for fname in columns["detection_files"]]
         assert(len(self.detection_timestamps) == len(self.detection_paths))
 
         self._set_name(self.dataset_path)
-        self._create_sample_sequences()
+        self._create_sample_sequences(columns)
         self.size = len(self.samples)
 
+    def load_detection_columns(self, use_cache=True, write_cache=True):
+        """
+        Returns all detections of the dataset as contiguous arrays (see
+        dataset_cache.detections_to_columns), from the cache if it is up to
+        date and otherwise by parsing the .json files. The frames are decoded
+        one at a time straight into the arrays (see frame_decoder.py), without
+        a Python object per agent. Only the detections matching the query are
+        returned, and only the frames that can contain them (according to the
+        frame index, or the cached timestamps for a time range) are read.
+        """
+        if use_cache:
+            with stage("load_cache"):
+                columns = load_columns(self.dataset_path, self.time_range, self._query_frame_files())
+            if columns is not None:
+                return self._query_columns(columns)
+
+        self.detection_timestamps, self.detection_paths = self._ordered_timestamp_detection_paths()
+        assert(len(self.detection_paths) > 0 or self._is_query())
+        with stage("load_detections", files=len(self.detection_paths)):
+            builder = ColumnBuilder()
+            for detection_path in self.detection_paths:
+                timestamp, obj_ids, positions, headings = decode_frame(detection_path)
+                builder.add_frame(timestamp, detection_id(detection_path), detection_path, \
+                                  obj_ids, positions, headings)
+            columns = builder.columns()
+        count("detection_files", len(self.detection_paths))
+
+        if write_cache and not self._is_query():
+            with stage("save_cache"):
+                save_columns(self.dataset_path, columns, self.detection_paths)
+        return self._query_columns(columns)
+
+    def _is_query(self):
+        return self.time_range is not None or self.query_agent_ids is not None or self.bounds is not None
+
+    def _query_frame_files(self):
+        """
+        Names of the frame files that can match the agent and area query,
+        from an up to date frame index, or None to read every frame.
+        """
+        if self.query_agent_ids is None and self.bounds is None:
+            return None
+        frames = load_index(self.dataset_path)
+        if not frames:
+            return None
+        return [frame["file"] for frame in select_frames(frames, None, self.query_agent_ids, self.bounds)]
+
+    def _query_columns(self, columns):
+        if self.time_range is not None:
+            columns = columns_in_time_range(columns, *self.time_range)
+        if self.query_agent_ids is not None or self.bounds is not None:
+            columns = filter_columns(columns, self.query_agent_ids, self.bounds)
+        return columns
+
     def __len__(self):
         return self.size
 
-    def _ordered_timestamp_detection_paths(self, detection_paths):
-        ordered_detections = []
-        for detection_path in detection_paths:
-            detection_file = open(detection_path, 'r')
-            detection = json.load(detection_file)
-            detection_file.close()
-            detection = detection
-            ordered_detections.append((detection['timestamp'], detection_path))
-
-        ordered_detections = sorted(ordered_detections)
-        timestamps, new_detection_paths = map(list, zip(*ordered_detections))
-        return timestamps, new_detection_paths
-
-    def _create_sample_sequences(self):
-        detections = self._load_all_detections()
-        ids_to_samples = self._create_samples(detections)
-        self.samples = list(ids_to_samples.values())
-        self.samples = self._slice_samples_by_sequence_length()
-
-    def _create_samples(self, detections):
-        ids_to_samples = dict()
-        for detection in detections:
-            # print(detection.detectionID)
-            timestamp = detection.timestamp
-
-            # Object ID to sample. One sample per obejct
-            for obj in detection.objects():
-                if obj.id not in ids_to_samples:
-                    ids_to_samples[obj.id] = Sample(obj.id, timestamp, detectionID=detection.detectionID)
-                sample = ids_to_samples[obj.id]
-                sample.add_position(obj.position)
-                sample.add_heading(obj.heading)
-                sample.add_timestamp(detection.timestamp)
-        return ids_to_samples
-
-    def _load_all_detections(self):
-        detections = []
+    @profiled("order_detections")
+    def _ordered_timestamp_detection_paths(self):
+        return ordered_detection_paths(self.dataset_path, self.time_range, self.query_agent_ids, self.bounds)
+
+    @profiled("build_windows")
+    def _create_sample_sequences(self, columns):
+        """
+        Lays out every agent's track contiguously in one position array
+        (followed by enough zero rows to pad its last windows) and indexes
+        the sliding windows of length sequence_length (at least
+        min_sequence_length) over it, as Sample.slice does.
+        """
+        frame_offsets = columns["frame_offsets"]
+        frame_idxs = np.repeat(np.arange(len(frame_offsets) - 1), np.diff(frame_offsets))
+        obj_ids = columns["obj_ids"]
+
+        # Agents in order of first appearance, rows grouped by agent (stable,
+        # so rows stay in timestamp order)
+        unique_ids, first_rows, row_agents, counts = np.unique(obj_ids, return_index=True, \
+                return_inverse=True, return_counts=True)
+        agent_order = np.argsort(first_rows, kind="stable")
+        agent_rank = np.empty_like(agent_order)
+        agent_rank[agent_order] = np.arange(len(agent_order))
+        row_agents = agent_rank[row_agents.reshape(-1)]
+        rows = np.argsort(row_agents, kind="stable")
+        counts = counts[agent_order]
+
+        min_length = max(self.min_sequence_length, 1)
+        padding = max(self.sequence_length - min_length, 0)
+        self.agent_offsets = np.concatenate([[0], np.cumsum(counts + padding)[:-1]]).astype(np.int64)
+        agent_starts = np.cumsum(counts) - counts
+        dest = self.agent_offsets[row_agents[rows]] + \
+               np.arange(len(rows)) - np.repeat(agent_starts, counts)
+
+        num_rows = int(np.sum(counts + padding))
+        self.positions = np.zeros((num_rows, 2), dtype=np.float32)
+        self.positions[dest] = columns["positions"][rows]
+        self.headings = np.zeros(num_rows, dtype=np.float32)
+        self.headings[dest] = columns["headings"][rows]
+        self.timestamps = np.zeros(num_rows, dtype=np.float64)
+        self.timestamps[dest] = columns["timestamps"][frame_idxs[rows]]
+
+        self.agent_ids = unique_ids[agent_order]
+        first_frames = frame_idxs[rows[agent_starts]] if len(rows) else np.zeros(0, dtype=np.int64)
+        self.agent_detection_ids = columns["detection_ids"][first_frames]
+
+        # Window index: (agent, start, length)
+        num_windows = np.maximum(counts - min_length + 1, 0)
+        window_agents = np.repeat(np.arange(len(counts)), num_windows)
+        window_starts = np.arange(len(window_agents)) - \
+                        np.repeat(np.cumsum(num_windows) - num_windows, num_windows)
+        window_lengths = np.minimum(self.sequence_length, counts[window_agents] - window_starts)
+        self.windows = np.stack([window_agents, window_starts, window_lengths], axis=1).astype(np.int64)
+        self.window_offsets = self.agent_offsets[window_agents] + window_starts
+
+        # Label mask for every possible window length
+        self.label_masks = window_label_masks(self.sequence_length, self.observed_history)
+
+        self.samples = SampleWindows(self.agent_ids, self.agent_detection_ids, self.positions, \
+                                     self.headings, self.timestamps, self.windows, self.window_offsets)
+
+    def agent_tracks(self):
+        """ The [length, 2] position track of every agent (in agent_ids order). """
+        padding = max(self.sequence_length - max(self.min_sequence_length, 1), 0)
+        ends = np.append(self.agent_offsets[1:], len(self.positions)) - padding
+        return [self.positions[start:end] for start, end in zip(self.agent_offsets, ends)]
+
+    def window_timestamps(self, step):
+        """ Timestamp of the step-th position of every window. """
+        return self.timestamps[self.window_offsets + step]
+
+    @profiled("materialize")
+    def materialize(self):
+        """
+        Precomputes the items of all windows as four contiguous tensors
+        (observed_pos [N, obs, 2], observed_headings [N, obs], y_delta
+        [N, horizon, 2] and mask [N, horizon]), equal to collating every
+        __getitem__.
+        """
+        steps = np.arange(self.sequence_length)
+        trajectories = torch.from_numpy(self.positions[self.window_offsets[:, None] + steps])
+        observed_pos = trajectories[:, :self.observed_history]
+        y_delta = trajectories[:, self.observed_history:] - trajectories[:, self.observed_history-1:-1]
+        observed_headings = torch.from_numpy(self.headings[self.window_offsets[:, None] + steps[:self.observed_history]])
+        masks = self.label_masks[torch.from_numpy(self.windows[:, 2])]
+        self.tensors = [observed_pos.contiguous(), observed_headings, y_delta, masks]
+        return self.tensors
+
+    def save_tensors(self, path):
+        """ Saves the materialized tensors (see materialize) to path. """
+        if self.tensors is None:
+            self.materialize()
+        torch.save({"sequence_length": self.sequence_length, "observed_history": self.observed_history, \
+                    "tensors": self.tensors}, path)
+
+    def load_tensors(self, path):
+        """
+        Loads tensors saved by save_tensors. Returns False (and keeps the
+        current tensors) if they do not match the windows of this dataset.
+        """
+        saved = torch.load(path)
+        if saved["sequence_length"] != self.sequence_length or \
+                saved["observed_history"] != self.observed_history or \
+                len(saved["tensors"][0]) != len(self):
+            return False
+        self.tensors = saved["tensors"]
+        return True
+
+    def batches(self, batch_size, indices=None):
+        """
+        Yields ([observed_pos, observed_headings], [y_delta, mask]) batches
+        of the windows (or of only those in indices, in order) by slicing
+        the materialized tensors, like a DataLoader without shuffling.
+        """
+        if self.tensors is None:
+            self.materialize()
+        tensors = self.tensors
+        if indices is not None:
+            indices = torch.as_tensor(indices, dtype=torch.long)
+            tensors = [tensor[indices] for tensor in tensors]
+        for start in range(0, len(tensors[0]), batch_size):
+            observed_pos, observed_headings, y_delta, mask = [tensor[start:start + batch_size] for tensor in tensors]
+            yield [observed_pos, observed_headings], [y_delta, mask]
+
+    def iter_detections(self):
+        """
+        Yields (detection, path) for every frame in timestamp order, reading
+        one file at a time.
+        """
         for detection_path in self.detection_paths:
-            detection = self._load_detection(detection_path)
-            detections.append(detection)
-        self.detections = detections
-        return detections
+            yield self._load_detection(detection_path), detection_path
 
     def _load_detection(self, detection_path):
-        with  open(detection_path, 'r') as detection_file:
-            detection_json = json.load(detection_file)
+        return load_detection(detection_path)
 
-        # Get ID from filename
-        fname = os.path.basename(detection_path)
-        idx = fname.find(".txt")
-        ID = int(''.join([c for c in fname[:idx] if c.isdigit()]))
+    @profiled("getitem", trace=False)
+    def __getitem__(self, index):
+        offset = self.window_offsets[index]
+        length = self.windows[index, 2]
 
-        detection = Detection.from_json(detection_json, ID=ID)
-        return detection
+        # Views into the padded position/heading arrays
+        trajectory = torch.from_numpy(self.positions[offset:offset + self.sequence_length])
+        observed_pos = trajectory[:self.observed_history]
+        y_delta = trajectory[self.observed_history:] - trajectory[self.observed_history-1:-1]
+        observed_headings = torch.from_numpy(self.headings[offset:offset + self.observed_history])
 
-    def _slice_samples_by_sequence_length(self):
-        expanded_samples = []
-        for sample in self.samples:
-            sliced_samples = sample.slice(self.sequence_length, self.min_sequence_length)
-            expanded_samples.extend(sliced_samples)
-        return expanded_samples
+        mask = self.label_masks[length]
 
-    def __getitem__(self, index):
-        sample = copy.deepcopy(self.samples[index])
+        return [observed_pos, observed_headings], [y_delta, mask]
 
-        mask = self._compute_label_mask(sample)[self.observed_history:]
-        mask = [torch.tensor(x) for x in mask]
-        mask = torch.stack(mask)
-        self._pad_sequence(sample)
+    def _set_name(self, dataset_path):
+        dataset_info = load_dataset_info(dataset_path)
+        self.name = dataset_info['dataset_name']
+        self.geofence = dataset_info.get('geofence')
 
-        observed_pos = torch.tensor(sample.trajectory.positions[:self.observed_history], dtype=torch.float32)
-        y_trajectory = np.array(sample.trajectory.positions)
-        y_delta = y_trajectory[self.observed_history:] - y_trajectory[self.observed_history-1:-1]
-        y_delta = torch.tensor(y_delta, dtype=torch.float32)
+def load_dataset_info(dataset_path):
+    """
+    Metadata of a dataset: dataset_name and, for datasets recorded in a
+    geofenced area, geofence as [lower x, upper x, lower y, upper y].
+    """
+    info_path = os.path.join(dataset_path, 'dataset_info.json')
+    with open(info_path, 'r') as info_file:
+        return json.load(info_file)
 
-        observed_headings = torch.tensor(sample.trajectory.headings[:self.observed_history], dtype=torch.float32)
+def ordered_detection_paths(dataset_path, time_range=None, agent_ids=None, bounds=None):
+    """
+    Timestamps and paths of the frame files of dataset_path in timestamp
+    order (from its frame index), optionally only those that can match a
+    query (see frame_index.select_frames).
+    """
+    frames = select_frames(ordered_frames(dataset_path), time_range, agent_ids, bounds)
+    timestamps = [frame["timestamp"] for frame in frames]
+    paths = [os.path.join(dataset_path, 'data', frame["file"]) for frame in frames]
+    return timestamps, paths
 
-        return [observed_pos, observed_headings], [y_delta, mask]
+def detection_id(detection_path):
+    """ ID of a frame, from its file name. """
+    fname = os.path.basename(detection_path)
+    idx = fname.find(".txt")
+    return int(''.join([c for c in fname[:idx] if c.isdigit()]))
 
-    def _compute_label_mask(self, sample):
-        mask = np.ones(self.sequence_length)
-        mask[len(sample):] = 0.
-        return mask
+@profiled("load_detection", trace=False)
+def load_detection(detection_path):
+    detection_json = read_json(detection_path)
+    detection = Detection.from_json(detection_json, ID=detection_id(detection_path))
+    return detection
 
-    def _pad_sequence(self, sample):
-        if len(sample) >= self.sequence_length:
-            return
+def window_label_masks(sequence_length, observed_history):
+    """ Label mask of the predicted steps for every possible window length. """
+    label_masks = np.tril(np.ones((sequence_length + 1, sequence_length)), k=-1)
+    return torch.from_numpy(label_masks[:, observed_history:])
 
-        padding_size = (self.sequence_length) - len(sample)
-        for i in range(padding_size):
-            sample.add_position([0, 0])
+class StreamingPedDataset(IterableDataset):
+    """
+    Iterable version of PedDataset for recordings that do not fit in memory.
+    Frames are read one at a time in timestamp order and only the last
+    sequence_length positions of every tracked agent are kept. With
+    agent_timeout set, memory is bounded by the agents seen in the last
+    agent_timeout frames x sequence_length instead of the length of the
+    recording; without it every agent stays tracked until the end.
 
-    def _set_name(self, dataset_path):
-        info_path = os.path.join(dataset_path, 'dataset_info.json')
-        dataset_info = json.load(open(info_path, 'r'))
+    Yields the same windows as PedDataset, in the order they complete: a full
+    length window as soon as its last position is read, and the shorter
+    windows at the end of a track once the recording ends or, if
+    agent_timeout is set, once the agent has not been seen for agent_timeout
+    frames (a track that reappears after that is treated as a new agent).
+    time_range, agent_ids and bounds restrict the stream to the matching
+    detections, as for PedDataset. A packed dataset (parse_data.py --packed)
+    has no .json frames, so its cached columns are loaded and streamed frame
+    by frame instead.
+    """
+    def __init__(self, dataset_path, sequence_length, observed_history, min_sequence_length,
+                 agent_timeout=None, time_range=None, agent_ids=None, bounds=None):
+        super(StreamingPedDataset, self).__init__()
+        self.dataset_path = dataset_path
+        self.sequence_length = sequence_length
+        self.observed_history = observed_history
+        self.min_sequence_length = min_sequence_length
+        self.agent_timeout = agent_timeout
+        self.time_range = time_range
+        self.agent_ids = None if agent_ids is None else set(agent_ids)
+        self.bounds = bounds
+        self.label_masks = window_label_masks(sequence_length, observed_history)
+
+        dataset_info = load_dataset_info(dataset_path)
         self.name = dataset_info['dataset_name']
+        self.geofence = dataset_info.get('geofence')
+
+        self.packed = len(detection_paths(dataset_path)) == 0
+        if self.packed and not os.path.exists(cache_path(dataset_path)):
+            raise ValueError("{} has no .json frames and no {}".format(dataset_path, os.path.basename(cache_path(dataset_path))))
+        self.detection_timestamps, self.detection_paths = [], []
+        if not self.packed:
+            self.detection_timestamps, self.detection_paths = \
+                    ordered_detection_paths(dataset_path, time_range, agent_ids, bounds)
+
+    def _window(self, track, start):
+        """ Item of the window of track (a deque of rows) starting at start. """
+        rows = np.array(list(track)[start:], dtype=np.float32)
+        trajectory = np.zeros((self.sequence_length, 2), dtype=np.float32)
+        trajectory[:len(rows)] = rows[:, :2]
+        trajectory = torch.from_numpy(trajectory)
+        observed_pos = trajectory[:self.observed_history]
+        y_delta = trajectory[self.observed_history:] - trajectory[self.observed_history-1:-1]
+        observed_headings = torch.from_numpy(rows[:self.observed_history, 2].copy())
+        return [observed_pos, observed_headings], [y_delta, self.label_masks[len(rows)]]
+
+    def _track_end(self, track, length):
+        """ The windows shorter than sequence_length at the end of a track. """
+        first = 1 if length >= self.sequence_length else 0
+        for start in range(first, len(track) - max(self.min_sequence_length, 1) + 1):
+            yield self._window(track, start)
+
+    def _matches(self, obj_id, position):
+        if self.agent_ids is not None and obj_id not in self.agent_ids:
+            return False
+        if self.bounds is not None:
+            x, y = position
+            return self.bounds[0] <= x <= self.bounds[1] and self.bounds[2] <= y <= self.bounds[3]
+        return True
+
+    def _frames(self):
+        """ obj_ids, positions and headings arrays of every frame in timestamp order. """
+        if not self.packed:
+            for detection_path in self.detection_paths:
+                yield decode_frame(detection_path)[1:]
+            return
+        columns = load_columns(self.dataset_path, self.time_range)
+        if columns is None:
+            raise ValueError("{} is out of date with {}".format(cache_path(self.dataset_path), self.dataset_path))
+        offsets = columns["frame_offsets"]
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield columns["obj_ids"][start:end], columns["positions"][start:end], columns["headings"][start:end]
+
+    def __iter__(self):
+        tracks = {} # obj_id -> [last rows, number of rows, last frame]
+        for frame, (obj_ids, positions, headings) in enumerate(self._frames()):
+            for obj_id, position, heading in zip(obj_ids.tolist(), positions.tolist(), headings.tolist()):
+                if not self._matches(obj_id, position):
+                    continue
+                if obj_id not in tracks:
+                    tracks[obj_id] = [deque(maxlen=self.sequence_length), 0, frame]
+                state = tracks[obj_id]
+                state[0].append((position[0], position[1], heading))
+                state[1] += 1
+                state[2] = frame
+                if state[1] >= self.sequence_length and \
+                        self.sequence_length >= self.min_sequence_length:
+                    yield self._window(state[0], 0)
+
+            if self.agent_timeout is not None:
+                expired = [obj_id for obj_id, state in tracks.items() \
+                           if frame - state[2] >= self.agent_timeout]
+                for obj_id in expired:
+                    yield from self._track_end(*tracks.pop(obj_id)[:2])
+
+        for track, length, _ in tracks.values():
+            yield from self._track_end(track, length)
@@ -4,25 +4,70 @@ Plots results of running CVM. Adapted from plotting script received from
 Christoph Scholler.
 Author: Abbie Lee (abbielee@mit.edu)
 """
+import os
+import multiprocessing
+
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
 import gif
 from tqdm import tqdm
 
-im = plt.imread("background.jpg")
+im = plt.imread(os.path.join(os.path.dirname(os.path.abspath(__file__)), "background.jpg"))
 
-def gen_frame(detection_trajs):
-    XI = 98.118385
-    XF = 169.524979
-    YI = 170.196945
-    YF = 226.819290
+# Geofence of the Town02 intersection shown in background.jpg, as
+# [lower x, upper x, lower y, upper y] (see 16412_pub.py)
+CARLA_GEOFENCE = [98.118385, 169.524979, 170.196945, 226.819290]
 
-    xlim = [XI, XF]
-    ylim = [YF, YI]
+def trajectory_bounds(trajectories, margin=1.):
+    """
+    [lower x, upper x, lower y, upper y] of all observed and true positions
+    in trajectories (a list of timesteps), padded by margin.
+    """
+    points = np.concatenate([np.asarray(trajectory[key]).reshape(-1, 2) \
+                             for ts in trajectories for trajectory in ts \
+                             for key in ("observed", "true")])
+    lower, upper = points.min(0) - margin, points.max(0) + margin
+    return [lower[0], upper[0], lower[1], upper[1]]
+
+def inside_geofence(points, geofence):
+    """ Boolean mask of the [..., 2] points that lie inside geofence. """
+    x, y = points[..., 0], points[..., 1]
+    return (x >= geofence[0]) & (x <= geofence[1]) & \
+           (y >= geofence[2]) & (y <= geofence[3])
+
+def frame_points(detection_trajs, geofence):
+    """
+    Clips the points of all trajectories of one timestep to geofence and
+    stacks them into the point sets that are drawn (history, true future,
+    prediction and current position), plus the timestep. The current
+    position of a trajectory is its first true position inside the geofence.
+    """
+    points = {}
+    for key in ("observed", "true", "predicted"):
+        stacked = np.concatenate([np.asarray(trajectory[key]) for trajectory in detection_trajs])
+        inside = inside_geofence(stacked, geofence)
+        points[key] = stacked[inside]
+        if key == "true":
+            has_current = inside.any(1)
+            current = stacked[np.arange(len(stacked)), inside.argmax(1)]
+            points["current"] = current[has_current]
+    points["ts"] = detection_trajs[-1]["ts"]
+    return points
+
+def setup_axes(ax, geofence, background=True):
+    """
+    Draws the static parts of a frame: background, limits, labels and legend.
+    Returns the legend.
+    """
+    xlim = [geofence[0], geofence[1]]
+    ylim = [geofence[3], geofence[2]]
 
-    fig, ax = plt.subplots(figsize=(8, 6), dpi=80)
     # set background
-    ax.imshow(im, extent=[xlim[0], xlim[1], ylim[1], ylim[0]])
+    if background:
+        ax.imshow(im, extent=[xlim[0], xlim[1], ylim[1], ylim[0]])
 
     ax.tick_params(labelsize=14)
     ax.set_xlabel("X", fontsize=16)
@@ -30,93 +75,153 @@ def gen_frame(detection_trajs):
     ax.set_xlim(xlim[0], xlim[1])
     ax.set_ylim(ylim[0], ylim[1])
 
-    for trajectory in detection_trajs:
-        true = trajectory["true"][0]
-        pred = trajectory["predicted"][0]
-        hist = trajectory["observed"][0]
-        ts = trajectory["ts"]
-
-        # find out of bounds points and delete
-        true_idxs = []
-        for i in range(true.shape[0]):
-            if true[i, 0] < xlim[0] or true[i, 0] > xlim[1] or \
-               true[i, 1] < ylim[1] or true[i, 1] > ylim[0]:
-                true_idxs.append(i)
-
-        pred_idxs = []
-        for i in range(pred.shape[0]):
-            if pred[i, 0] < xlim[0] or pred[i, 0] > xlim[1] or \
-               pred[i, 1] < ylim[1] or pred[i, 1] > ylim[0]:
-                pred_idxs.append(i)
-
-        hist_idxs = []
-        for i in range(hist.shape[0]):
-            if hist[i, 0] < xlim[0] or hist[i, 0] > xlim[1] or \
-               hist[i, 1] < ylim[1] or hist[i, 1] > ylim[0]:
-                hist_idxs.append(i)
+    # Make legend
+    x, y = [], []
+    l1, = ax.plot(x, y, 'o', fillstyle="none", color='r', alpha=0.5, markersize=8, label='history')
+    l2, = ax.plot(x, y, 'o', color='k', markersize=10, label='current')
+    l3, = ax.plot(x, y, 'o', fillstyle="none", color='g', alpha=0.5, markersize=8, label='true future')
+    l4, = ax.plot(x, y, 'o', fillstyle="none", color='b', alpha=0.5, markersize=8, label='prediction')
+    return ax.legend((l1, l2, l3, l4), ("history", "current", "true future", "prediction"), loc="lower right")
 
-        true = np.delete(true, true_idxs, axis=0)
-        pred = np.delete(pred, pred_idxs, axis=0)
-        hist = np.delete(hist, hist_idxs, axis=0)
+def plot_points(ax, points):
+    """
+    Plots the output of frame_points, one artist per point set. Returns the
+    artists.
+    """
+    artists = {}
+    # plot observed_history
+    artists["observed"], = ax.plot(points["observed"][:,0], points["observed"][:,1], 'o', fillstyle="none", color='r', alpha=0.5, markersize=8)
 
-        if 0 in true.shape:
-            true = np.array([[0, 0]])
+    # plot gt
+    artists["true"], = ax.plot(points["true"][:,0], points["true"][:,1], 'o', fillstyle="none", color='g', alpha=0.5, markersize=8)
 
-        if 0 in pred.shape:
-            pred = np.array([[0, 0]])
+    # plot pred
+    artists["predicted"], = ax.plot(points["predicted"][:,0], points["predicted"][:,1], 'o', fillstyle="none", color='b', alpha=0.5, markersize=8)
 
-        if 0 in hist.shape:
-            hist = np.array([[0, 0]])
+    # plot current point
+    artists["current"], = ax.plot(points["current"][:,0], points["current"][:,1], 'o', color='k', alpha=1.0, markersize=10)
+    return artists
 
-        # plot observed_history
-        ax.plot(hist[:,0], hist[:,1], 'o', fillstyle="none", color='r', alpha=0.5, markersize=8)
+def gen_frame(detection_trajs, geofence=CARLA_GEOFENCE, background=True):
+    fig, ax = plt.subplots(figsize=(8, 6), dpi=80)
+    points = frame_points(detection_trajs, geofence)
+    plot_points(ax, points)
+    setup_axes(ax, geofence, background)
 
-        # plot gt
-        ax.plot(true[:,0], true[:,1], 'o', fillstyle="none", color='g', alpha=0.5, markersize=8)
+    ax.set_title("t = " + str(int(points["ts"])), fontsize=16)
 
-        # plot pred
-        ax.plot(pred[:,0], pred[:,1], 'o', fillstyle="none", color='b', alpha=0.5, markersize=8)
+class FrameRenderer:
+    """
+    Draws frames that look like gen_frame's, but sets up the figure,
+    background and legend once and only redraws the trajectory points on top
+    of a cached background (blitting). Uses the Agg canvas directly, so it is
+    safe to use in worker processes.
+    """
 
-        # plot current point
-        ax.plot(true[0,0], true[0,1], 'o', color='k', alpha=1.0, markersize=10)
+    def __init__(self, geofence=CARLA_GEOFENCE, background=True):
+        self.geofence = geofence
+        self.background = background
+
+        self.fig = Figure(figsize=(8, 6), dpi=80)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111)
+        empty = np.zeros((0, 2))
+        self.artists = plot_points(self.ax, {key: empty for key in ("observed", "true", "predicted", "current")})
+        self.legend = setup_axes(self.ax, geofence, background)
+        self.title = self.ax.set_title(" ", fontsize=16)
+
+        self.animated = list(self.artists.values()) + [self.legend, self.title]
+        for artist in self.animated:
+            artist.set_animated(True)
+
+        self.canvas.draw()
+        self.static = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def render(self, points):
+        """
+        points: output of frame_points
+        Returns the frame as an RGB PIL image.
+        """
+        for key, artist in self.artists.items():
+            artist.set_data(points[key][:, 0], points[key][:, 1])
+        self.title.set_text("t = " + str(int(points["ts"])))
+
+        self.canvas.restore_region(self.static)
+        for artist in self.animated:
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.fig.bbox)
+
+        rgba = np.asarray(self.canvas.buffer_rgba())
+        return Image.fromarray(rgba[:, :, :3].copy())
+
+_renderer = None
+
+def _render_frame(job):
+    """
+    Worker function: renders one frame and saves it if a path is given,
+    otherwise returns it quantized to a GIF palette.
+    """
+    global _renderer
+    points, fpath, geofence, background = job
+    if _renderer is None or _renderer.geofence != geofence or \
+            _renderer.background != background:
+        _renderer = FrameRenderer(geofence, background)
+    img = _renderer.render(points)
+    if fpath is None:
+        return img.quantize(method=Image.Quantize.FASTOCTREE)
+    img.save(fpath)
+
+def plot_geofence(trajectories, geofence):
+    """
+    Plotting area and whether to draw the background image: the dataset
+    geofence (e.g. the CARLA intersection) with background, otherwise the
+    extent of the trajectories without.
+    """
+    if geofence is None:
+        return trajectory_bounds(trajectories), False
+    return list(geofence), True
 
-    # Make legend
-    x, y = [], []
-    l1, = ax.plot(x, y, 'o', fillstyle="none", color='r', alpha=0.5, markersize=8, label='history')
-    l2, = ax.plot(x, y, 'o', color='k', markersize=10, label='current')
-    l3, = ax.plot(x, y, 'o', fillstyle="none", color='g', alpha=0.5, markersize=8, label='true future')
-    l4, = ax.plot(x, y, 'o', fillstyle="none", color='b', alpha=0.5, markersize=8, label='prediction')
-    ax.legend((l1, l2, l3, l4), ("history", "current", "true future", "prediction"), loc="lower right")
+def render_frames(trajectories, fpaths=None, geofence=None, workers=None):
+    """
+    Renders every timestep of trajectories in order, fanned out over a pool
+    of workers processes (all cores by default). Returns the frames as
+    palette PIL images, or saves them to fpaths if given.
+    """
+    geofence, background = plot_geofence(trajectories, geofence)
+    jobs = [(frame_points(ts, geofence), fpaths[i] if fpaths is not None else None, \
+             geofence, background) for i, ts in enumerate(trajectories)]
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        return list(tqdm(map(_render_frame, jobs), total=len(jobs)))
 
-    ax.set_title("t = " + str(int(ts)), fontsize=16)
+    chunksize = max(1, len(jobs) // (4 * workers))
+    with multiprocessing.Pool(workers) as pool:
+        return list(tqdm(pool.imap(_render_frame, jobs, chunksize=chunksize), total=len(jobs)))
 
 @gif.frame
-def gen_gif_img(ts):
+def gen_gif_img(ts, geofence=CARLA_GEOFENCE, background=True):
     """
     ts: list of trajectories occuring in timestep ts
     """
-    gen_frame(ts)
+    gen_frame(ts, geofence, background)
 
-def plotting_gif(trajectories, outpath):
+def plotting_gif(trajectories, outpath, geofence=None, workers=None):
     """
     trajectories: list of length number of timesteps, where each timestep is a
                   list of trajectories in that timestep
     outpath: relative path to save gif
+    geofence: [lower x, upper x, lower y, upper y] plotting area of the
+              dataset (default: extent of the trajectories)
+    workers: number of rendering processes (default: all cores)
     """
-    imgs = []
-    for ts in tqdm(trajectories):
-        imgs.append(gen_gif_img(ts))
-
+    imgs = render_frames(trajectories, geofence=geofence, workers=workers)
     gif.save(imgs, outpath, duration=300)
 
-def plotting_saveimgs(trajectories, outpath):
-    counter = 0
-    for ts in tqdm(trajectories):
-        gen_frame(ts)
-        plt.savefig(outpath + "/%06d.jpg" % counter)
-        plt.close()
-        counter += 1
+def plotting_saveimgs(trajectories, outpath, geofence=None, workers=None):
+    fpaths = [outpath + "/%06d.jpg" % counter for counter in range(len(trajectories))]
+    render_frames(trajectories, fpaths=fpaths, geofence=geofence, workers=workers)
 
-def plotting(trajectories):
-    gen_frame(trajectories)
+def plotting(trajectories, geofence=None):
+    geofence, background = plot_geofence([trajectories], geofence)
+    gen_frame(trajectories, geofence, background)
     plt.show()
@@ -0,0 +1,190 @@
+"""
+16.412 Intent Inference GC | predictor.py
+Online CVM predictor. Ingests one detection frame at a time (the dict format
+of the dataset .json files, see Detection.from_json), keeps a ring buffer of
+the last observed_history positions of every active agent and predicts the
+future of all agents with a full history in one batched call to
+constant_velocity_model.
+
+Latency benchmark:
+    python predictor.py --benchmark
+"""
+import time
+import argparse
+
+import numpy as np
+import torch
+
+from cvm import *
+
+
+class Predictor:
+
+    def __init__(self, observed_history=8, prediction_horizon=9, use_angvel=False,
+            sample=False, num_samples=20, sample_angle_std=25, seed=0,
+            capacity=64):
+        """
+        observed_history: number of positions per agent fed to the model
+        capacity: initial number of agent slots (grows as needed)
+        Remaining options are passed through to constant_velocity_model.
+        """
+        self.observed_history = observed_history
+        self.prediction_horizon = prediction_horizon
+        self.use_angvel = use_angvel
+        self.sample = sample
+        self.num_samples = num_samples
+        self.sample_angle_std = sample_angle_std
+        self.generator = torch.Generator().manual_seed(seed)
+
+        self.ids_to_slots = {}
+        self.free_slots = []
+        self.positions = np.zeros((0, observed_history, 2), dtype=np.float32)
+        self.headings = np.zeros((0, observed_history), dtype=np.float32)
+        self.counts = np.zeros(0, dtype=np.int64) # positions seen per slot
+        self._grow(capacity)
+
+        self.timestamp = None
+
+    def _grow(self, capacity):
+        old_capacity = len(self.counts)
+        if capacity <= old_capacity:
+            return
+        self.positions = np.concatenate([self.positions, \
+                np.zeros((capacity - old_capacity, self.observed_history, 2), dtype=np.float32)])
+        self.headings = np.concatenate([self.headings, \
+                np.zeros((capacity - old_capacity, self.observed_history), dtype=np.float32)])
+        self.counts = np.concatenate([self.counts, np.zeros(capacity - old_capacity, dtype=np.int64)])
+        self.free_slots.extend(range(capacity - 1, old_capacity - 1, -1))
+
+    def __len__(self):
+        return len(self.ids_to_slots)
+
+    def _assign_slots(self, obj_ids):
+        """
+        Evicts agents missing from obj_ids and returns the slot of each ID,
+        allocating slots for new agents.
+        """
+        present = set(obj_ids)
+        for obj_id in [i for i in self.ids_to_slots if i not in present]:
+            slot = self.ids_to_slots.pop(obj_id)
+            self.counts[slot] = 0
+            self.free_slots.append(slot)
+
+        num_new = len(present) - len(self.ids_to_slots)
+        if num_new > len(self.free_slots):
+            self._grow(max(2*len(self.counts), len(self.ids_to_slots) + num_new))
+
+        slots = np.empty(len(obj_ids), dtype=np.int64)
+        for i, obj_id in enumerate(obj_ids):
+            if obj_id not in self.ids_to_slots:
+                self.ids_to_slots[obj_id] = self.free_slots.pop()
+            slots[i] = self.ids_to_slots[obj_id]
+        return slots
+
+    def update(self, detection_json):
+        """
+        Adds one detection frame. Agents that are not in the frame are
+        forgotten.
+        """
+        objects = detection_json['object_list']
+        obj_ids = [obj['id'] for obj in objects]
+        positions = np.array([obj['position'] for obj in objects], dtype=np.float32).reshape(-1, 2)
+        # Same convention as DetectedObject.from_json
+        headings = np.array([obj['heading'] if 'angular velocity' in obj else 0 \
+                             for obj in objects], dtype=np.float32)
+
+        slots = self._assign_slots(obj_ids)
+        heads = self.counts[slots] % self.observed_history
+        self.positions[slots, heads] = positions
+        self.headings[slots, heads] = headings
+        self.counts[slots] += 1
+        self.timestamp = detection_json['timestamp']
+
+    def histories(self):
+        """
+        Returns (obj_ids, positions [N, obs, 2], headings [N, obs]) of all
+        agents with a full observed history, oldest position first.
+        """
+        obj_ids = np.array(list(self.ids_to_slots.keys()), dtype=np.int64)
+        slots = np.array(list(self.ids_to_slots.values()), dtype=np.int64)
+        ready = self.counts[slots] >= self.observed_history
+        obj_ids, slots = obj_ids[ready], slots[ready]
+
+        # The next write position of a full ring buffer holds its oldest entry
+        order = (self.counts[slots, None] + np.arange(self.observed_history)) % self.observed_history
+        positions = np.take_along_axis(self.positions[slots], order[:, :, None], axis=1)
+        headings = np.take_along_axis(self.headings[slots], order, axis=1)
+        return obj_ids, positions, headings
+
+    def predict(self):
+        """
+        Returns (obj_ids, predicted absolute positions) for all agents with a
+        full observed history. Predictions are [N, prediction_horizon, 2], or
+        [N, num_samples, prediction_horizon, 2] when sampling.
+        """
+        obj_ids, positions, headings = self.histories()
+        observed = torch.from_numpy(positions)
+        with torch.no_grad():
+            y_pred_rel = constant_velocity_model(observed, torch.from_numpy(headings), \
+                    prediction_horizon=self.prediction_horizon, \
+                    use_angvel=self.use_angvel, sample=self.sample, \
+                    num_samples=self.num_samples, \
+                    sample_angle_std=self.sample_angle_std, \
+                    generator=self.generator)
+            last_pos = observed[:, -1]
+            if self.sample:
+                last_pos = last_pos.unsqueeze(1)
+            predicted_positions = rel_to_abs(y_pred_rel, last_pos)
+        return obj_ids, predicted_positions
+
+    def step(self, detection_json):
+        """ update() followed by predict(). """
+        self.update(detection_json)
+        return self.predict()
+
+def synthetic_frames(num_agents, num_frames, seed=0):
+    """
+    Frames of num_agents agents walking straight lines with random constant
+    velocities.
+    """
+    rng = np.random.default_rng(seed)
+    start = rng.uniform(0, 100, (num_agents, 2))
+    velocity = rng.normal(0, 1, (num_agents, 2))
+    for t in range(num_frames):
+        positions = (start + t*velocity).round(2).tolist()
+        yield {"timestamp": t, "size": num_agents, "frame": t, \
+               "object_list": [{"position": p, "id": i} for i, p in enumerate(positions)]}
+
+def benchmark(agent_counts=(50, 500, 5000), num_frames=100, **predictor_kwargs):
+    """
+    Per-frame step() latency for each number of concurrent agents.
+    """
+    results = []
+    for num_agents in agent_counts:
+        frames = list(synthetic_frames(num_agents, num_frames))
+        predictor = Predictor(**predictor_kwargs)
+        latencies = []
+        for frame in frames:
+            start = time.perf_counter()
+            predictor.step(frame)
+            latencies.append(time.perf_counter() - start)
+        latencies = 1000 * np.array(latencies[predictor.observed_history:])
+        results.append({"agents": num_agents, "mean_ms": latencies.mean(), \
+                        "p99_ms": np.percentile(latencies, 99), "max_ms": latencies.max()})
+    return results
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description='Online CVM predictor.')
+    parser.add_argument('--benchmark', action='store_true', help='Measure per-frame latency at 50/500/5000 agents.')
+    parser.add_argument('--frames', default=100, type=int, help='Frames per benchmark run.')
+    parser.add_argument('--sample', action='store_true', help='Turns on the sampling for the CVM (OUR-S).')
+    parser.add_argument("--use_angvel", action="store_true", help="Use angular velocity in prediction.")
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    if args.benchmark:
+        results = benchmark(num_frames=args.frames, sample=args.sample, use_angvel=args.use_angvel)
+        for r in results:
+            print("{agents:>6d} agents: mean {mean_ms:.3f} ms, p99 {p99_ms:.3f} ms, max {max_ms:.3f} ms".format(**r))
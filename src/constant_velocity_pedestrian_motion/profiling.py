@@ -0,0 +1,141 @@
+"""
+16.412 Intent Inference GC | profiling.py
+Opt-in instrumentation of the evaluation hot paths. When enabled (with
+evaluate.py --profile or the CVM_PROFILE environment variable), timed stages
+and counters are collected, a per-stage summary table is printed at exit and
+the stages are written as a Chrome trace (open in chrome://tracing or
+Perfetto). When disabled, every hook is a cheap no-op.
+
+    CVM_PROFILE=1 python evaluate.py
+    CVM_PROFILE=trace.json python evaluate.py
+    python evaluate.py --profile trace.json --cprofile evaluate.prof
+"""
+import os
+import time
+import json
+import atexit
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+
+DEFAULT_TRACE_PATH = "cvm_trace.json"
+
+_enabled = False
+_trace_path = None
+_events = [] # Chrome trace events
+_stats = {} # stage name -> [count, total_ns, min_ns, max_ns]
+_counters = {} # counter name -> value
+_start_ns = time.perf_counter_ns()
+
+
+def enabled():
+    return _enabled
+
+def enable(trace_path=DEFAULT_TRACE_PATH):
+    """
+    Turns on profiling. The summary is printed and the trace written to
+    trace_path (if not None) when the process exits.
+    """
+    global _enabled, _trace_path
+    if not _enabled:
+        atexit.register(report)
+    _enabled = True
+    _trace_path = trace_path
+
+def _record(name, start_ns, end_ns, trace, args):
+    duration = end_ns - start_ns
+    stat = _stats.get(name)
+    if stat is None:
+        _stats[name] = [1, duration, duration, duration]
+    else:
+        stat[0] += 1
+        stat[1] += duration
+        stat[2] = min(stat[2], duration)
+        stat[3] = max(stat[3], duration)
+    if trace:
+        _events.append({"name": name, "ph": "X", "pid": os.getpid(), \
+                        "tid": threading.get_ident(), \
+                        "ts": (start_ns - _start_ns) / 1000., "dur": duration / 1000., \
+                        "args": args})
+
+@contextmanager
+def _stage(name, trace, args):
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        _record(name, start_ns, time.perf_counter_ns(), trace, args)
+
+def stage(name, trace=True, **args):
+    """
+    Context manager timing the enclosed block as stage name. Stages with
+    trace=False are only aggregated in the summary (use for per-item hot
+    paths); args are attached to the trace event.
+    """
+    if not _enabled:
+        return nullcontext()
+    return _stage(name, trace, args)
+
+def profiled(name, trace=True):
+    """ Decorator timing every call of a function as stage name. """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _stage(name, trace, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    """ Adds n to counter name. """
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+def timed_iter(name, iterable, trace=True):
+    """
+    Yields from iterable, timing each step of the iteration (e.g. DataLoader
+    collation) as stage name.
+    """
+    iterator = iter(iterable)
+    while True:
+        if not _enabled:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        else:
+            with _stage(name, trace, {}):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+        yield item
+
+def summary():
+    """ Per-stage summary table and counters as a string. """
+    lines = ["{:<28s} {:>8s} {:>11s} {:>11s} {:>11s} {:>11s}".format( \
+             "stage", "calls", "total [s]", "mean [ms]", "min [ms]", "max [ms]")]
+    for name, (calls, total, lo, hi) in sorted(_stats.items(), key=lambda s: -s[1][1]):
+        lines.append("{:<28s} {:>8d} {:>11.4f} {:>11.4f} {:>11.4f} {:>11.4f}".format( \
+                     name, calls, total / 1e9, total / calls / 1e6, lo / 1e6, hi / 1e6))
+    for name, value in sorted(_counters.items()):
+        lines.append("{:<28s} {:>8}".format(name, value))
+    return "\n".join(lines)
+
+def write_trace(path):
+    with open(path, "w") as trace_file:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms", \
+                   "otherData": {"counters": _counters}}, trace_file)
+
+def report():
+    print("\n== Profile ==")
+    print(summary())
+    if _trace_path:
+        write_trace(_trace_path)
+        print("Trace written to {}".format(_trace_path))
+
+if os.environ.get("CVM_PROFILE"):
+    value = os.environ["CVM_PROFILE"]
+    enable(DEFAULT_TRACE_PATH if value in ("1", "true", "yes") else value)
@@ -0,0 +1,136 @@
+"""
+16.412 Intent Inference GC | result_cache.py
+On-disk cache of evaluation results (summed ADE/FDE and, for runs that
+plot, the predicted positions and per-window ADE/FDE) so repeated runs of
+evaluate.py with the same configuration, e.g. to re-plot or re-report, skip
+the prediction. Entries are keyed by a hash of the evaluated windows (the
+dataset content, not its path) and of the configuration fields that affect
+the predictions, so only changed datasets are recomputed. The least recently
+used entries are evicted once the cache grows beyond its size limit.
+
+    python result_cache.py # number and size of the entries
+    python result_cache.py --clear
+"""
+import os
+import json
+import hashlib
+import argparse
+import tempfile
+
+import numpy as np
+import torch
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".result_cache")
+MAX_CACHE_BYTES = 1 << 30 # 1 GiB
+CACHE_VERSION = 2
+
+# RunConfig fields that change the predictions or errors of a window
+CONFIG_KEYS = ["observed_history", "prediction_horizon", "sequence_length", "min_sequence_length",
+               "batch_size", "use_angvel", "sample", "num_samples", "sample_angle_std", "sample_seed"]
+
+
+def dataset_fingerprint(dataset, indices=None):
+    """ Hash of the windows of dataset (only those in indices, if given). """
+    digest = hashlib.sha1()
+    for array in (dataset.positions, dataset.headings, dataset.windows, dataset.window_offsets):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    if indices is not None:
+        digest.update(np.asarray(indices, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+def result_key(fingerprint, config):
+    """ Cache key of the results of config (a dict with CONFIG_KEYS) on a dataset. """
+    config = {key: config[key] for key in CONFIG_KEYS}
+    content = json.dumps({"version": CACHE_VERSION, "dataset": fingerprint, "config": config}, sort_keys=True)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+def result_bytes(result):
+    """ Size of the tensor data of a result dict (a lower bound of its file size). """
+    return sum(value.element_size() * value.nelement() for value in result.values() if torch.is_tensor(value))
+
+class ResultCache:
+    """ Directory of torch.save'd result dicts with LRU eviction. """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".pt")
+
+    def get(self, key):
+        """ The cached result of key, or None. A hit marks the entry as recently used. """
+        fpath = self.path(key)
+        try:
+            result = torch.load(fpath)
+        except (OSError, EOFError, RuntimeError):
+            return None
+        os.utime(fpath)
+        return result
+
+    def put(self, key, result):
+        """
+        Stores result (a dict of tensors) under key and evicts old entries.
+        A result larger than the whole cache is not written (returns False).
+        """
+        size = result_bytes(result)
+        if size > self.max_bytes:
+            print("Result of {:.1f} MB exceeds the result cache limit of {:.1f} MB, not cached".format( \
+                  size / 1e6, self.max_bytes / 1e6))
+            return False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write to a temporary file first, so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp_file:
+            torch.save(result, tmp_file)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+        return True
+
+    def entries(self):
+        """ (last use, size, path) of every entry, least recently used first. """
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith(".pt"):
+                fpath = os.path.join(self.cache_dir, fname)
+                try:
+                    stat = os.stat(fpath)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fpath))
+        return sorted(entries)
+
+    def evict(self):
+        """ Removes least recently used entries until the cache fits in max_bytes. """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, fpath in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fpath)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, fpath in self.entries():
+            os.remove(fpath)
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description='Inspects or clears the evaluation result cache.')
+    parser.add_argument('--cache_dir', default=CACHE_DIR, help='Cache directory.')
+    parser.add_argument('--clear', action='store_true', help='Remove all entries.')
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    cache = ResultCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+    entries = cache.entries()
+    print("{}: {} entries, {:.1f} MB".format(args.cache_dir, len(entries), \
+          sum(size for _, size, _ in entries) / 1e6))
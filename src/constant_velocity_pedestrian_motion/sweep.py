@@ -0,0 +1,180 @@
+"""
+16.412 Intent Inference GC | sweep.py
+Hyperparameter sweep of the CVM. Every dataset is loaded once and all
+combinations of use_angvel, from_headings, average_thetas, damping_factor and
+sample_angle_std are predicted and scored in one vectorized pass per chunk
+of windows: the step rotations of every (angular velocity, damping)
+combination and the sampled rotations of every angle std are stacked as
+extra tensor dimensions. The sampled rotations are drawn in the same batches
+and with the same seed as an unsharded evaluate.py run, so every row of the
+results table matches the corresponding evaluate.py run.
+
+    python sweep.py --out sweep_results.csv
+    python sweep.py --sample --damping 0.8 0.9 0.95 --angle_std 10 25 40
+"""
+import csv
+import time
+import argparse
+import itertools
+
+import numpy as np
+import torch
+
+from cvm import *
+from evaluate import RunConfig, load_dataset, shard_seed
+
+COLUMNS = ["dataset", "use_angvel", "from_headings", "average_thetas", "damping_factor", \
+           "sample_angle_std", "ade", "fde", "windows"]
+CHUNK_ELEMENTS = 1 << 18 # predicted steps per vectorized chunk (small enough to stay in cache)
+
+
+def step_combinations(use_angvel, from_headings, average_thetas, damping_factor):
+    """
+    The distinct (use_angvel, from_headings, average_thetas, damping_factor)
+    combinations. The options of the angular velocity do not matter without
+    use_angvel, so they are None in its single combination.
+    """
+    combinations = []
+    if False in use_angvel:
+        combinations.append((False, None, None, None))
+    if True in use_angvel:
+        combinations += [(True,) + c for c in itertools.product(from_headings, average_thetas, damping_factor)]
+    return combinations
+
+def chunk_errors(observed, headings, true_positions, masks, combinations, prediction_horizon, \
+                 sample_normals=None, sample_angle_stds=None):
+    """
+    Summed ADE and FDE [C, S] of a chunk of windows for C step combinations
+    (see step_combinations) and S sample angle stds (S=1 without sampling).
+    sample_normals [n, K] are the standard normal draws of
+    cvm.sample_rotations, scaled by each std. Errors are the best of K as in
+    metrics.avg_disp and metrics.final_disp.
+    """
+    steps = torch.arange(1, prediction_horizon+1, dtype=observed.dtype)
+    thetas, coefficients = {}, []
+    for use_angvel, from_headings, average_thetas, damping_factor in combinations:
+        key = (from_headings, average_thetas)
+        if use_angvel and key not in thetas:
+            thetas[key] = angular_velocity(observed, headings, from_headings=from_headings, \
+                                           average_thetas=average_thetas)
+        coefficients.append(steps * damping_factor**steps if use_angvel else torch.zeros_like(steps))
+    zeros = torch.zeros(len(observed), dtype=observed.dtype)
+    combination_thetas = torch.stack([thetas[c[1:3]] if c[0] else zeros for c in combinations])
+    step_angles = combination_thetas[:, None, :, None, None] * torch.stack(coefficients)[:, None, None, None, :] # [C, 1, n, 1, H]
+
+    # Displacements rotated by the step angles, summed over the horizon
+    deltas = observed[:, -1] - observed[:, -2]
+    dx, dy = deltas[:, 0, None, None], deltas[:, 1, None, None]
+    c, s = torch.cos(step_angles), torch.sin(step_angles)
+    offset_x, offset_y = torch.cumsum(dx*c - dy*s, dim=-1), torch.cumsum(dx*s + dy*c, dim=-1)
+    if sample_normals is not None:
+        # A sampled rotation turns every step by the same angle, so it can be
+        # applied to the summed displacements instead of to every step
+        stds = torch.as_tensor(sample_angle_stds, dtype=observed.dtype) * np.pi / 180.
+        sample_angles = (stds[:, None, None] * sample_normals)[None, :, :, :, None] # [1, S, n, K, 1]
+        c, s = torch.cos(sample_angles), torch.sin(sample_angles)
+        offset_x, offset_y = (offset_x*c).addcmul_(offset_y, s, value=-1), (offset_x*s).addcmul_(offset_y, c) # [C, S, n, K, H]
+
+    # Distances to the true positions, in place on the (largest) offset tensors
+    true_offsets = true_positions - observed[:, -1, None]
+    dists = offset_x.sub_(true_offsets[:, None, :, 0]).square_() \
+            .add_(offset_y.sub_(true_offsets[:, None, :, 1]).square_()).sqrt_().mul_(masks[:, None]) # [C, S, n, K, H]
+    ades = (dists.sum(-1) / masks.sum(1)[:, None]).min(-1)[0]
+    last_idxs = (masks.sum(1).long() - 1).clamp(min=0)
+    fdes = dists.gather(-1, last_idxs.view(1, 1, -1, 1, 1).expand(*dists.shape[:-1], 1)).squeeze(-1).min(-1)[0]
+    return ades.sum(-1), fdes.sum(-1)
+
+def sweep_testset(testset, combinations, sample_angle_stds=None, indices=None):
+    """
+    ADE and FDE [C, S] of every step combination and sample angle std (no
+    sampling if None) on all windows of testset, or only those in indices,
+    and the number of evaluated windows.
+    """
+    num_stds = 1 if sample_angle_stds is None else len(sample_angle_stds)
+    num_samples = 1 if sample_angle_stds is None else RunConfig.num_samples
+    per_window = len(combinations) * num_stds * num_samples * RunConfig.prediction_horizon
+    chunk_size = max(1, CHUNK_ELEMENTS // per_window)
+    generator = torch.Generator().manual_seed(shard_seed(RunConfig.sample_seed, 0))
+
+    sum_ades = torch.zeros(len(combinations), num_stds, dtype=torch.float64)
+    sum_fdes = torch.zeros(len(combinations), num_stds, dtype=torch.float64)
+    num_windows = 0
+    with torch.no_grad():
+        for (observed, headings), (y_true_rel, masks) in testset.batches(RunConfig.batch_size, indices):
+            true_positions = rel_to_abs(y_true_rel, observed[:, -1])
+            # one draw per batch, as cvm.sample_rotations does in evaluate.py
+            normals = None if sample_angle_stds is None else \
+                      torch.randn(len(observed), num_samples, generator=generator, dtype=observed.dtype)
+            for start in range(0, len(observed), chunk_size):
+                chunk = slice(start, start + chunk_size)
+                ades, fdes = chunk_errors(observed[chunk], headings[chunk], true_positions[chunk], masks[chunk], \
+                                          combinations, RunConfig.prediction_horizon, \
+                                          None if normals is None else normals[chunk], sample_angle_stds)
+                sum_ades += ades
+                sum_fdes += fdes
+            num_windows += len(observed)
+    return sum_ades / max(num_windows, 1), sum_fdes / max(num_windows, 1), num_windows
+
+def result_rows(name, combinations, sample_angle_stds, ades, fdes, num_windows):
+    rows = []
+    stds = [None] if sample_angle_stds is None else sample_angle_stds
+    for i, (use_angvel, from_headings, average_thetas, damping_factor) in enumerate(combinations):
+        for j, sample_angle_std in enumerate(stds):
+            rows.append({"dataset": name, "use_angvel": use_angvel, "from_headings": from_headings, \
+                         "average_thetas": average_thetas, "damping_factor": damping_factor, \
+                         "sample_angle_std": sample_angle_std, "ade": ades[i, j].item(), \
+                         "fde": fdes[i, j].item(), "windows": num_windows})
+    return rows
+
+def parse_commandline():
+    flags = lambda value: [bool(int(v)) for v in value]
+    parser = argparse.ArgumentParser(description='Evaluates a grid of CVM hyperparameters in one pass per dataset.')
+    parser.add_argument('--datasets', nargs='+', default=RunConfig.dataset_paths, help='Dataset directories to evaluate.')
+    parser.add_argument('--use_angvel', nargs='+', type=int, default=[0, 1], choices=[0, 1], help='use_angvel values.')
+    parser.add_argument('--from_headings', nargs='+', type=int, default=[0], choices=[0, 1], help='from_headings values.')
+    parser.add_argument('--average_thetas', nargs='+', type=int, default=[0], choices=[0, 1], help='average_thetas values.')
+    parser.add_argument('--damping', nargs='+', type=float, default=np.linspace(0.8, 0.98, 10).round(2).tolist(), \
+                        help='damping_factor values.')
+    parser.add_argument('--sample', action='store_true', help='Sample rotations (OUR-S), sweeping --angle_std.')
+    parser.add_argument('--angle_std', nargs='+', type=float, default=np.linspace(5, 50, 10).tolist(), \
+                        help='sample_angle_std values (degrees), with --sample.')
+    parser.add_argument('--num_samples', default=RunConfig.num_samples, type=int, help='Samples per window, with --sample.')
+    parser.add_argument('--seed', default=RunConfig.sample_seed, type=int, help='Seed for the sampled rotations.')
+    parser.add_argument('--out', default='sweep_results.csv', help='Output .csv file.')
+    args = parser.parse_args()
+    args.use_angvel, args.from_headings, args.average_thetas = \
+        flags(args.use_angvel), flags(args.from_headings), flags(args.average_thetas)
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    RunConfig.num_samples = args.num_samples
+    RunConfig.sample_seed = args.seed
+    combinations = step_combinations(args.use_angvel, args.from_headings, args.average_thetas, args.damping)
+    sample_angle_stds = args.angle_std if args.sample else None
+    print("Sweeping {} combinations".format(len(combinations) * (len(sample_angle_stds) if args.sample else 1)))
+
+    rows, totals, total_windows = [], 0., 0
+    for dataset_path in args.datasets:
+        testset = load_dataset(dataset_path)
+        start = time.perf_counter()
+        ades, fdes, num_windows = sweep_testset(testset, combinations, sample_angle_stds)
+        print("Swept {} ({} windows) in {:.2f} s".format(testset.name, num_windows, time.perf_counter() - start))
+        rows += result_rows(testset.name, combinations, sample_angle_stds, ades, fdes, num_windows)
+        totals = totals + num_windows * torch.stack([ades, fdes])
+        total_windows += num_windows
+    # Weighted by the number of windows in each testset, as in evaluate.py
+    average = result_rows("average", combinations, sample_angle_stds, *(totals / max(total_windows, 1)), total_windows)
+    rows += average
+
+    with open(args.out, "w", newline="") as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print("\n== Best combinations (average ADE) ==")
+    print("{:>10s} {:>13s} {:>14s} {:>14s} {:>16s} {:>8s} {:>8s}".format(*COLUMNS[1:8]))
+    for row in sorted(average, key=lambda row: row["ade"])[:10]:
+        print("{:>10} {:>13} {:>14} {:>14} {:>16} {:8.4f} {:8.4f}".format( \
+              *[str(row[column]) for column in COLUMNS[1:6]], row["ade"], row["fde"]))
+    print("Results written to {}".format(args.out))
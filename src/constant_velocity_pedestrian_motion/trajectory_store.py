@@ -0,0 +1,85 @@
+"""
+16.412 Intent Inference GC | trajectory_store.py
+Compact store of the observed, predicted and true trajectories of every
+evaluated window, for plotting. The trajectories live in preallocated
+tensors (one row per window) and are grouped by timestamp on access, instead
+of one dict of tensors per window and sample.
+"""
+import numpy as np
+import torch
+
+
+class TrajectoryStore:
+    """
+    Maps the timestamp of the last observed position to the trajectories of
+    that timestep, like the ts_to_trajectories dict previously built by
+    evaluate.py. store[ts] is a list with one dict of stacked "observed"
+    [n, obs, 2], "predicted" [n*K, horizon, 2] and "true" [n, horizon, 2]
+    positions and "ts", as expected by the plotting functions.
+    """
+
+    def __init__(self, num_windows, observed_history, prediction_horizon, num_samples=None):
+        predicted_shape = (num_windows, prediction_horizon, 2) if num_samples is None else \
+                          (num_windows, num_samples, prediction_horizon, 2)
+        self.observed = torch.zeros(num_windows, observed_history, 2)
+        self.predicted = torch.zeros(predicted_shape)
+        self.true = torch.zeros(num_windows, prediction_horizon, 2)
+        self.timestamps = np.zeros(num_windows, dtype=np.float64)
+        self.size = 0
+        self._order, self._keys, self._starts = None, None, None
+
+    def add(self, timestamps, observed, predicted, true):
+        """ Appends a batch of windows. """
+        rows = slice(self.size, self.size + len(observed))
+        self.timestamps[rows] = timestamps
+        self.observed[rows] = observed
+        self.predicted[rows] = predicted
+        self.true[rows] = true
+        self.size = rows.stop
+        self._order = None
+
+    @classmethod
+    def merge(cls, stores):
+        """ One store with the windows of all stores. """
+        stores = [store for store in stores if store is not None]
+        merged = cls.__new__(cls)
+        merged.observed = torch.cat([store.observed[:store.size] for store in stores])
+        merged.predicted = torch.cat([store.predicted[:store.size] for store in stores])
+        merged.true = torch.cat([store.true[:store.size] for store in stores])
+        merged.timestamps = np.concatenate([store.timestamps[:store.size] for store in stores])
+        merged.size = len(merged.timestamps)
+        merged._order = None
+        return merged
+
+    def _index(self):
+        if self._order is None:
+            self._order = np.argsort(self.timestamps[:self.size], kind="stable")
+            self._keys, self._starts = np.unique(self.timestamps[self._order], return_index=True)
+            self._starts = np.append(self._starts, self.size)
+        return self._order, self._keys, self._starts
+
+    def keys(self):
+        """ Timestamps in increasing order. """
+        return self._index()[1].tolist()
+
+    def __len__(self):
+        return len(self._index()[1])
+
+    def __contains__(self, timestamp):
+        keys = self._index()[1]
+        i = np.searchsorted(keys, timestamp)
+        return i < len(keys) and keys[i] == timestamp
+
+    def __getitem__(self, timestamp):
+        order, keys, starts = self._index()
+        i = np.searchsorted(keys, timestamp)
+        if i == len(keys) or keys[i] != timestamp:
+            raise KeyError(timestamp)
+        rows = torch.from_numpy(order[starts[i]:starts[i+1]])
+        predicted = self.predicted[rows]
+        return [{"observed": self.observed[rows], "true": self.true[rows], \
+                 "predicted": predicted.reshape(-1, *predicted.shape[-2:]), "ts": keys[i].item()}]
+
+    def frames(self):
+        """ store[ts] of every timestamp, in time order. """
+        return [self[timestamp] for timestamp in self.keys()]
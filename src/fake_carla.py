@@ -0,0 +1,170 @@
+"""
+16.412 Intent Inference GC | fake_carla.py
+Local stand-in for the subset of the carla Python API used by the recorder
+(carla_recorder.py), so recording can be run and benchmarked without the
+simulator. The world plays a scene of replay.py: by default vehicles driving
+at constant speed along straight and turning routes through the Town02 T
+intersection recorded by 16412_pub.py (replay.SyntheticScene), or existing
+recordings (replay.RecordedScene), optionally paced to real time.
+"""
+import numpy as np
+
+from replay import SyntheticScene, Pacer, ReplayFinished, RECORD_EVERY
+
+
+class Vector3D:
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __repr__(self):
+        return "Vector3D(x=%f, y=%f, z=%f)" % (self.x, self.y, self.z)
+
+class Location(Vector3D):
+    def __repr__(self):
+        return "Location(x=%f, y=%f, z=%f)" % (self.x, self.y, self.z)
+
+class Transform:
+    def __init__(self, location):
+        self.location = location
+
+class TrafficLight:
+    def __init__(self, ID):
+        self.id = ID
+
+class Vehicle:
+    """
+    Actor of a scene agent. Its state is the one of the current tick of its
+    world; an agent absent from that tick is located at NaN.
+    """
+
+    def __init__(self, world, slot, ID):
+        self.world = world
+        self.slot = slot
+        self.id = ID
+        self.type_id = "vehicle.fake"
+        self.destroyed = False
+
+    def _vector(self, values, cls=Vector3D):
+        row = self.world.rows[self.slot]
+        if row < 0:
+            return cls(np.nan, np.nan, np.nan)
+        x, y, z = values[row].tolist()
+        return cls(x, y, z)
+
+    def get_transform(self):
+        return Transform(self.get_location())
+
+    def get_location(self):
+        return self._vector(self.world.state.positions, Location)
+
+    def get_velocity(self):
+        return self._vector(self.world.state.velocities)
+
+    def get_angular_velocity(self):
+        return self._vector(self.world.state.angular_velocities)
+
+    def get_acceleration(self):
+        return self._vector(self.world.state.accelerations)
+
+    def is_at_traffic_light(self):
+        row = self.world.rows[self.slot]
+        return row >= 0 and self.world.state.light_ids[row] >= 0
+
+    def get_traffic_light(self):
+        if not self.is_at_traffic_light():
+            return None
+        return TrafficLight(int(self.world.state.light_ids[self.world.rows[self.slot]]))
+
+    def set_autopilot(self, enabled=True):
+        pass
+
+    def destroy(self):
+        self.destroyed = True
+        return True
+
+class ActorList(list):
+    def filter(self, pattern):
+        prefix = pattern.rstrip("*")
+        return ActorList(actor for actor in self if actor.type_id.startswith(prefix))
+
+class WorldSnapshot:
+    """ Snapshot of the current tick; find returns the (live) vehicle. """
+
+    def __init__(self, frame, elapsed_seconds, actors=None):
+        self.frame = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.actors = actors or {}
+
+    def find(self, actor_id):
+        return self.actors.get(actor_id)
+
+class World:
+    """
+    Plays a scene with simulation frames of DELTA_SECONDS: a tick advances
+    one frame, and the state of the scene tick with that frame number (if
+    any) is loaded, paced to speed times real time (as fast as possible if
+    None). ReplayFinished is raised a recording interval (RECORD_EVERY
+    frames) after the last tick of the scene.
+    """
+    DELTA_SECONDS = 0.05
+
+    def __init__(self, scene, speed=None):
+        self.scene = scene
+        self.pacer = Pacer(speed)
+        self.agent_ids = np.asarray(scene.agent_ids())
+        self.vehicles = ActorList(Vehicle(self, slot, ID) for slot, ID in enumerate(self.agent_ids.tolist()))
+        self.actors = {vehicle.id: vehicle for vehicle in self.vehicles}
+        self.rows = np.full(len(self.vehicles), -1, dtype=np.int64) # row of each vehicle in the state
+        self.index = -1
+        self.next_state = scene[0]
+        self._load_next()
+        self.frame = self.state.frame
+
+    def _load_next(self):
+        self.index += 1
+        self.state = self.next_state
+        self.rows.fill(-1)
+        self.rows[np.searchsorted(self.agent_ids, self.state.ids)] = np.arange(len(self.state))
+        self.pacer.wait(self.state.timestamp)
+        try:
+            self.next_state = self.scene[self.index + 1]
+        except ReplayFinished:
+            self.next_state = None
+
+    def elapsed_seconds(self):
+        return self.state.timestamp + (self.frame - self.state.frame) * self.DELTA_SECONDS
+
+    def wait_for_tick(self):
+        return self.tick()
+
+    def tick(self):
+        if self.next_state is None and self.frame + 1 - self.state.frame >= RECORD_EVERY:
+            raise ReplayFinished()
+        self.frame += 1
+        if self.next_state is not None and self.frame >= self.next_state.frame:
+            self._load_next()
+        return WorldSnapshot(self.frame, self.elapsed_seconds())
+
+    def get_snapshot(self):
+        return WorldSnapshot(self.frame, self.elapsed_seconds(), self.actors)
+
+    def get_actors(self):
+        return ActorList(vehicle for vehicle in self.vehicles if not vehicle.destroyed)
+
+class Client:
+    def __init__(self, host='127.0.0.1', port=2000, num_vehicles=50, seed=0, scene=None, speed=None):
+        self.world = World(scene or SyntheticScene(num_vehicles, seed), speed)
+
+    def set_timeout(self, seconds):
+        pass
+
+    def get_world(self):
+        return self.world
+
+    def start_recorder(self, filename):
+        return filename
+
+    def stop_recorder(self):
+        pass
@@ -3,12 +3,66 @@
 Converts text representation of CARLA sim data into .json files for use with
 Constant Velocity Method (CVM) trajectory prediction.
 Author: Abbie Lee (abbielee@mit.edu)
+
+Each recording is parsed in a single vectorized pass into a numeric array.
+Frames are then produced by a k-way merge of the per-agent recordings (which
+are ordered by frame) and written out one at a time, either as one .json
+file per frame or as a single packed dataset file (see
+constant_velocity_pedestrian_motion/dataset_cache.py).
 """
 
 import json
 import os
+import sys
+import heapq
 import argparse
 
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                             "constant_velocity_pedestrian_motion"))
+from dataset_cache import save_columns
+from frame_index import frame_entry, write_index
+
+# Columns of a parsed recording row
+FRAME, TIMESTAMP = 0, 1
+POSITION = slice(2, 5)
+VELOCITY = slice(5, 8)
+HEADING = 8
+ANGULAR_VELOCITY = slice(9, 12)
+ACCELERATION = slice(12, 15)
+LIGHT = slice(15, 17)
+NUM_COLUMNS = 17
+
+def agent_id(fname):
+    """
+    Extracts the id of an agent from the file name of its recording.
+    """
+    idx = fname.find(".txt")
+    return int(''.join([c for c in fname[:idx] if c.isdigit()]))
+
+def read_recording(fpath):
+    """
+    Reads a recording .txt into an array with one row per recorded frame in
+    frame order (see the column constants above). A repeated frame keeps its
+    last row. Values are not rounded.
+    """
+    with open(fpath, mode='r') as f:
+        next(f) # skip header row
+        text = f.read().strip()
+
+    if not text:
+        return np.zeros((0, NUM_COLUMNS))
+
+    # Every field is numeric, so flatten the " | " and "," separated
+    # records into one list of numbers
+    text = text.replace(" | ", ",").replace("\r", "").replace("\n", ",")
+    data = np.array(text.split(","), dtype=np.float64).reshape(-1, NUM_COLUMNS)
+
+    # One row per frame in frame order; a repeated frame keeps its last row
+    frames, last_rows = np.unique(data[::-1, FRAME], return_index=True)
+    return data[len(data) - 1 - last_rows]
+
 class Agent:
     def __init__(self, fpath, labels = None):
         """
@@ -24,8 +78,8 @@ class Agent:
         self.labels = labels
         if self.labels == None: self.set_labels()
 
-        # Maps frame number to (agent data dict, timestamp) tuple
-        self.frames = {}
+        # One row per recorded frame, see the column constants above
+        self.data = None
 
         self.process_file()
 
@@ -33,12 +87,11 @@ class Agent:
         """
         Extracts id of agent from file name.
         """
-        idx = self.fname.find(".txt")
-        self.ID = int(''.join([c for c in self.fname[:idx] if c.isdigit()]))
+        self.ID = agent_id(self.fname)
 
     def set_labels(self):
-        f = open(self.fpath, mode='r')
-        line = f.readline().rstrip()
+        with open(self.fpath, mode='r') as f:
+            line = f.readline().rstrip()
         self.labels = line.split(" | ")
 
     def __equal__(self, other):
@@ -58,51 +111,50 @@ class Agent:
 
         Should make more generalizable later. If possible? Might not be.
         """
-        with open(self.fpath, mode='r') as f:
-            next(f) # skip header row
-            for line in f:
-                elements = line.split(" | ")
-
-                frame = int(elements[0])
-                timestamp = round(float(elements[1]), 2)
-
-                pos = [round(float(e), 2) for e in elements[2].split(',')]
-                vel = [round(float(e), 2) for e in elements[3].split(',')]
-                heading = float(elements[4])
-                angvel = [round(float(e), 2) for e in elements[5].split(',')]
-                accel = [round(float(e), 2) for e in elements[6].split(',')]
-
-                light = [int(e) for e in elements[7].split(',')]
+        self.data = read_recording(self.fpath)
 
-                # 2D world representation
-                agent_dict = {}
-                agent_dict["position"] = pos[:2]
-                agent_dict["velocity"] = vel[:2]
-                agent_dict["heading"] = heading
-                agent_dict["angular velocity"] = angvel[2] # only z component (yaw rate)
-                agent_dict["acceleration"] = accel[:2]
-                agent_dict["light status"] = {"stopped": light[0], "lightID": light[1]}
-                agent_dict["id"] = self.ID
+        # Same rounding as the original per-line parser
+        for cols in [TIMESTAMP, POSITION, VELOCITY, ANGULAR_VELOCITY, ACCELERATION]:
+            self.data[:, cols] = np.round(self.data[:, cols], 2)
 
-                # Add data to frame
-                self.frames[frame] = (agent_dict, timestamp)
+    @property
+    def frames(self):
+        return self.data[:, FRAME].astype(np.int64)
 
-    def to_dict(self, frameID):
+    def to_dict(self, row):
         """
-        Returns agent state dict for a given frame ID.
+        Returns agent state dict (2D world representation) for a given row.
         """
-        return self.frames[frameID][0]
+        values = self.data[row].tolist()
+        agent_dict = {}
+        agent_dict["position"] = values[POSITION][:2]
+        agent_dict["velocity"] = values[VELOCITY][:2]
+        agent_dict["heading"] = values[HEADING]
+        agent_dict["angular velocity"] = values[ANGULAR_VELOCITY][2] # only z component (yaw rate)
+        agent_dict["acceleration"] = values[ACCELERATION][:2]
+        light = [int(e) for e in values[LIGHT]]
+        agent_dict["light status"] = {"stopped": light[0], "lightID": light[1]}
+        agent_dict["id"] = self.ID
+        return agent_dict
+
+    def rows(self, agent_idx):
+        """
+        Yields (frame, agent_idx, row) for every recorded frame, in the order
+        of the recording.
+        """
+        for row, frame in enumerate(self.frames.tolist()):
+            yield frame, agent_idx, row
 
 class Frame:
     def __init__(self, frameID, timestamp):
         self.frameID = frameID
-        self.agents = {} # active agents in this frame; maps agentID to Agent object
+        self.agents = {} # active agents in this frame; maps agentID to agent state dict
         self.timestamp = timestamp
         self.size = 0
 
-    def add_agent(self, agent):
-        if agent.ID not in self.agents.keys():
-            self.agents[agent.ID] = agent
+    def add_agent(self, agent_dict):
+        if agent_dict["id"] not in self.agents.keys():
+            self.agents[agent_dict["id"]] = agent_dict
             self.size += 1
 
     def __equal__(self, other):
@@ -114,24 +166,23 @@ class Frame:
         return "Frame ID: " + str(self.frameID) + ", Timestamp: " + str(self.timestamp)
 
     def to_dict(self):
-        agents = [a.to_dict(self.frameID) for a in self.agents.values()]
+        agents = list(self.agents.values())
         frame_dict = {"timestamp": self.timestamp, "object_list": agents, \
                       "frame": self.frameID, "size": self.size}
         return frame_dict
 
 class MultiAgentScene:
-    def __init__(self, dirpath, labels = None):
+    def __init__(self, dirpath, labels = None, geofence = None):
         self.dirpath = dirpath
         self.labels = labels
+        self.geofence = geofence # [lower x, upper x, lower y, upper y] of the recorded area
         self.agents = [] # all the agents in this scene
-        self.frames = {} # maps frame ID to Frame objects
-        self.size = len(self.frames)
+        self.size = 0 # number of frames
         self.gen_scene()
 
     def gen_scene(self):
         """
-        Iterates over .txt files and populations MultiAgentScene with relevant
-        Frames, and populates Frames with relevant Agents.
+        Parses the .txt files of all agents in the scene.
         """
         directory = os.fsencode(self.dirpath)
 
@@ -139,43 +190,98 @@ class MultiAgentScene:
         for file in os.listdir(directory):
              filename = os.fsdecode(file)
              if filename.endswith(".txt"):
-                 new_agent = Agent(self.dirpath+filename, self.labels)
+                 new_agent = Agent(os.path.join(self.dirpath, filename), self.labels)
                  self.agents.append(new_agent)
 
-        # create frames
-        for ag in self.agents:
-            for fr, data in ag.frames.items():
-                ag_dict = data[0]
-                timestamp = data[1]
-                if fr in self.frames.keys():
-                    self.frames[fr].add_agent(ag)
-                else:
-                    new_frame = Frame(fr, timestamp)
-                    new_frame.add_agent(ag)
-                    self.frames[fr] = new_frame
+        if self.agents:
+            self.size = len(np.unique(np.concatenate([ag.frames for ag in self.agents])))
 
-        self.size = len(self.frames)
+    def frames(self):
+        """
+        Yields the Frames of the scene in frame order by merging the
+        (frame-ordered) agent recordings. The frame timestamp is the one
+        recorded by the first agent in the frame.
+        """
+        rows = heapq.merge(*[ag.rows(i) for i, ag in enumerate(self.agents)])
+        frame = None
+        for frameID, agent_idx, row in rows:
+            if frame is None or frame.frameID != frameID:
+                if frame is not None:
+                    yield frame
+                agent = self.agents[agent_idx]
+                frame = Frame(frameID, agent.data[row, TIMESTAMP].item())
+            frame.add_agent(self.agents[agent_idx].to_dict(row))
+        if frame is not None:
+            yield frame
 
     def to_json_dataset(self, outpath):
         """
-        Writes .json files for this scene to the specified outpath.
+        Writes .json files for this scene to the specified outpath, along
+        with their timestamp index (see
+        constant_velocity_pedestrian_motion/frame_index.py).
         """
-        counter = 1
-        frames = sorted(self.frames.values(), key = lambda f : f.frameID)
-        for fr in frames:
-            with open(outpath + "data/"+ str(counter) + ".json", mode="w") as json_file:
-                json.dump(fr.to_dict(), json_file)
-            counter += 1
-
+        os.makedirs(os.path.join(outpath, "data"), exist_ok=True)
+        index = []
+        for counter, fr in enumerate(self.frames(), 1):
+            fpath = os.path.join(outpath, "data", str(counter) + ".json")
+            frame_dict = fr.to_dict()
+            with open(fpath, mode="w") as json_file:
+                json.dump(frame_dict, json_file)
+            index.append(frame_entry(fpath, frame_dict))
+        write_index(outpath, index)
+
+        self.write_dataset_info(outpath)
+
+    def to_packed_dataset(self, outpath):
+        """
+        Writes this scene as a single packed dataset file (the columnar
+        dataset cache format read by PedDataset) instead of .json files.
+        """
+        os.makedirs(outpath, exist_ok=True)
+        data = np.concatenate([ag.data for ag in self.agents])
+        agent_idxs = np.repeat(np.arange(len(self.agents)), [len(ag.data) for ag in self.agents])
+        obj_ids = np.array([ag.ID for ag in self.agents], dtype=np.int64)[agent_idxs]
+
+        # Order by frame, then agent, and keep the first row of an agent in a
+        # frame (as Frame.add_agent does)
+        order = np.lexsort((np.arange(len(data)), agent_idxs, data[:, FRAME]))
+        data, obj_ids = data[order], obj_ids[order]
+        frames = data[:, FRAME].astype(np.int64)
+        keep = np.ones(len(data), dtype=bool)
+        keep[1:] = (frames[1:] != frames[:-1]) | (obj_ids[1:] != obj_ids[:-1])
+        data, obj_ids, frames = data[keep], obj_ids[keep], frames[keep]
+
+        frame_starts = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1]])
+        counters = np.arange(1, len(frame_starts) + 1)
+        columns = {
+            "timestamps": data[frame_starts, TIMESTAMP],
+            "detection_ids": counters,
+            "detection_files": np.array([str(c) + ".json" for c in counters]),
+            "frame_offsets": np.r_[frame_starts, len(data)].astype(np.int64),
+            "obj_ids": obj_ids,
+            "positions": data[:, POSITION][:, :2],
+            "headings": data[:, HEADING],
+        }
+        save_columns(outpath, columns, [])
+
+        self.write_dataset_info(outpath)
+
+    def write_dataset_info(self, outpath):
         # create dataset info file
-        ds_name = os.path.basename(outpath[:-1])
-        with open(outpath + "dataset_info.json", mode="w") as json_file:
-            json.dump({"dataset_name": ds_name}, json_file)
+        ds_name = os.path.basename(os.path.normpath(outpath))
+        dataset_info = {"dataset_name": ds_name}
+        if self.geofence is not None:
+            dataset_info["geofence"] = self.geofence
+        with open(os.path.join(outpath, "dataset_info.json"), mode="w") as json_file:
+            json.dump(dataset_info, json_file)
 
 def parse_commandline():
     parser = argparse.ArgumentParser(description='Parses .txt from CARLA to .json for use with CVM-based predictors.')
     parser.add_argument('--data', required=True, action='store', help='Path to .txt data files')
     parser.add_argument('--outpath', required=True, action='store', help='Path to directory for output files')
+    parser.add_argument('--geofence', nargs=4, type=float, default=None, metavar=('XMIN', 'XMAX', 'YMIN', 'YMAX'), \
+                        help='Geofence used for the recording (see 16412_pub.py), stored in dataset_info.json')
+    parser.add_argument('--packed', action='store_true', help='Write a single packed dataset file instead of .json files')
     args = parser.parse_args()
     return args
 
@@ -190,5 +296,8 @@ if __name__ == "__main__":
     labels = ["frame", "timestamp", "position", "velocity", "heading", \
               "angular velocity", "acceleration", "light status"]
 
-    MAS = MultiAgentScene(data_path, labels)
-    MAS.to_json_dataset(out_path)
+    MAS = MultiAgentScene(data_path, labels, args.geofence)
+    if args.packed:
+        MAS.to_packed_dataset(out_path)
+    else:
+        MAS.to_json_dataset(out_path)
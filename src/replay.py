@@ -0,0 +1,361 @@
+"""
+16.412 Intent Inference GC | replay.py
+Offline sources of simulator data, to load-test the pipeline without CARLA.
+A scene is a sequence of ticks holding the state of every agent present at
+that tick (a FrameState). It is either replayed from recordings (the
+myrecording*.txt files of 16412_pub.py or a converted dataset directory) or
+generated for any number of agents driving through the recorded
+intersection. Scenes are emitted at real time, N times faster or as fast as
+possible, as detection frames in the dataset .json format (for the online
+predictor.Predictor) or through the carla stand-in of fake_carla.py (for
+carla_recorder.Recorder).
+
+Load test recording, parsing, evaluation and online prediction with
+    python replay.py --synthetic 2000 --frames 200
+    python replay.py --source data/carla_long_raw --speed 10
+"""
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                             "constant_velocity_pedestrian_motion"))
+import parse_data
+from carla_recorder import Recorder, record_loop, in_geofence, GEOFENCE
+from frame_index import ordered_frames
+from frame_decoder import read_json
+from dataset_cache import load_columns
+
+# Simulation frames between two recorded ticks, and their duration (see 16412_pub.py)
+RECORD_EVERY = 10
+TICK_SECONDS = RECORD_EVERY * 0.05
+
+# Polylines through the Town02 T intersection (west, south and east
+# entries), see the routes learned by
+# constant_velocity_pedestrian_motion/intent.py
+ROUTES = [
+    [(90.0, 191.6), (132.0, 191.6), (132.0, 235.0)], # west -> south (right)
+    [(90.0, 191.6), (178.0, 191.6)], # west -> east (straight)
+    [(136.0, 235.0), (136.0, 187.5), (90.0, 187.5)], # south -> west (left)
+    [(136.0, 235.0), (136.0, 191.6), (178.0, 191.6)], # south -> east (right)
+    [(178.0, 187.5), (90.0, 187.5)], # east -> west (straight)
+    [(178.0, 187.5), (136.0, 187.5), (136.0, 235.0)], # east -> south (left)
+]
+
+
+class ReplayFinished(Exception):
+    """ Raised when a scene has no more ticks. """
+
+class FrameState:
+    """
+    State of the agents present at one tick: ids [n], positions, velocities,
+    angular velocities and accelerations [n, 3], headings [n] (degrees) and
+    the id of the traffic light each agent is stopped at, -1 if none [n].
+    """
+    __slots__ = ["frame", "timestamp", "ids", "positions", "velocities", "angular_velocities", \
+                 "accelerations", "headings", "light_ids"]
+
+    def __init__(self, frame, timestamp, ids, positions, velocities, angular_velocities, \
+                 accelerations, headings, light_ids):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.ids = ids
+        self.positions = positions
+        self.velocities = velocities
+        self.angular_velocities = angular_velocities
+        self.accelerations = accelerations
+        self.headings = headings
+        self.light_ids = light_ids
+
+    def __len__(self):
+        return len(self.ids)
+
+class RecordedScene:
+    """
+    Scene replayed from recorded rows, stored as columns ordered by frame
+    (rows of frame i are frame_offsets[i]:frame_offsets[i+1]).
+    """
+
+    def __init__(self, frames, timestamps, frame_offsets, ids, positions, velocities, \
+                 angular_velocities, accelerations, headings, light_ids):
+        self.frames = frames
+        self.timestamps = timestamps
+        self.frame_offsets = frame_offsets
+        self.columns = (ids, positions, velocities, angular_velocities, accelerations, headings, light_ids)
+
+    @classmethod
+    def from_rows(cls, frames, timestamps, ids, *values):
+        """ Scene of unordered rows (one per agent and frame). """
+        order = np.lexsort((ids, frames))
+        frames, ids = frames[order], ids[order]
+        starts = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1]])
+        return cls(frames[starts], timestamps[order][starts], np.r_[starts, len(frames)].astype(np.int64), \
+                   ids, *[value[order] for value in values])
+
+    @classmethod
+    def from_recordings(cls, dirpath):
+        """ Scene of the myrecording*.txt files of dirpath, values not rounded. """
+        data, ids = [], []
+        for fpath in sorted(glob.glob(os.path.join(dirpath, '*.txt'))):
+            recording = parse_data.read_recording(fpath)
+            data.append(recording)
+            ids.append(np.full(len(recording), parse_data.agent_id(os.path.basename(fpath)), dtype=np.int64))
+        data = np.concatenate(data) if data else np.zeros((0, parse_data.NUM_COLUMNS))
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+        stopped, light_ids = data[:, parse_data.LIGHT].T
+        return cls.from_rows(data[:, parse_data.FRAME].astype(np.int64), data[:, parse_data.TIMESTAMP], ids, \
+                             data[:, parse_data.POSITION], data[:, parse_data.VELOCITY], \
+                             data[:, parse_data.ANGULAR_VELOCITY], data[:, parse_data.ACCELERATION], \
+                             data[:, parse_data.HEADING], np.where(stopped > 0, light_ids, -1).astype(np.int64))
+
+    @classmethod
+    def from_dataset(cls, dataset_path):
+        """
+        Scene of a dataset directory: its .json frames, or only positions and
+        headings for a packed dataset without them. Missing vector components
+        are 0; frames without a frame number are numbered RECORD_EVERY apart.
+        """
+        frames = ordered_frames(dataset_path) if glob.glob(os.path.join(dataset_path, 'data', '*.json')) else []
+        if not frames:
+            columns = load_columns(dataset_path)
+            counts = np.diff(columns["frame_offsets"])
+            num_rows = len(columns["obj_ids"])
+            frame_numbers = RECORD_EVERY * np.repeat(np.arange(len(counts)), counts)
+            zeros = np.zeros((num_rows, 3))
+            positions = np.c_[columns["positions"], np.zeros(num_rows)]
+            return cls.from_rows(frame_numbers, np.repeat(columns["timestamps"], counts), columns["obj_ids"], \
+                                 positions, zeros, zeros, zeros, columns["headings"], np.full(num_rows, -1))
+
+        rows = []
+        for i, frame in enumerate(frames):
+            frame_json = read_json(os.path.join(dataset_path, 'data', frame["file"]))
+            frame_number = frame_json.get('frame', RECORD_EVERY * i)
+            for obj in frame_json['object_list']:
+                light = obj.get('light status', {"stopped": 0, "lightID": 0})
+                rows.append((frame_number, frame_json['timestamp'], obj['id'], \
+                             *obj['position'][:2], *obj.get('velocity', (0, 0))[:2], \
+                             obj.get('angular velocity', 0), *obj.get('acceleration', (0, 0))[:2], \
+                             obj.get('heading', 0), light["lightID"] if light["stopped"] else -1))
+        rows = np.array(rows, dtype=np.float64).reshape(-1, 12)
+        zeros = np.zeros(len(rows))
+        return cls.from_rows(rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2].astype(np.int64), \
+                             np.c_[rows[:, 3:5], zeros], np.c_[rows[:, 5:7], zeros], \
+                             np.c_[zeros, zeros, rows[:, 7]], np.c_[rows[:, 8:10], zeros], \
+                             rows[:, 10], rows[:, 11].astype(np.int64))
+
+    @classmethod
+    def load(cls, path):
+        """ Scene of a directory of recordings or of a dataset. """
+        if glob.glob(os.path.join(path, '*.txt')):
+            return cls.from_recordings(path)
+        return cls.from_dataset(path)
+
+    def agent_ids(self):
+        return np.unique(self.columns[0])
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        if i >= len(self.frames):
+            raise ReplayFinished()
+        rows = slice(self.frame_offsets[i], self.frame_offsets[i+1])
+        return FrameState(int(self.frames[i]), float(self.timestamps[i]), *[column[rows] for column in self.columns])
+
+class SyntheticScene:
+    """
+    num_agents vehicles looping at constant speed along ROUTES, each waiting
+    at a red light at the start of its route once per loop. States are
+    computed for all agents at once on demand, so the scene has no end and
+    scales to thousands of agents. Ticks are tick_seconds apart and numbered
+    frame_step apart.
+    """
+
+    def __init__(self, num_agents, seed=0, tick_seconds=TICK_SECONDS, frame_step=RECORD_EVERY):
+        rng = np.random.default_rng(seed)
+        self.tick_seconds = tick_seconds
+        self.frame_step = frame_step
+        # Routes padded to three vertices (a zero length last segment)
+        self.vertices = np.array([route + route[-1:] * (3 - len(route)) for route in ROUTES], dtype=np.float64)
+        self.segment_lengths = np.linalg.norm(np.diff(self.vertices, axis=1), axis=2) # [routes, 2]
+
+        self.ids = np.arange(1, num_agents + 1, dtype=np.int64)
+        self.routes = rng.integers(len(ROUTES), size=num_agents)
+        self.speeds = rng.uniform(4, 9, num_agents)
+        self.stop_ticks = rng.integers(0, 20, num_agents)
+        self.offsets = rng.integers(0, 1000, num_agents)
+        self.light_ids = self.routes % 3 + 1
+        length = self.segment_lengths[self.routes].sum(1)
+        self.loop_ticks = np.ceil(length / (self.speeds * tick_seconds)).astype(np.int64) + self.stop_ticks
+
+    def agent_ids(self):
+        return self.ids
+
+    def __len__(self):
+        return sys.maxsize
+
+    def _kinematics(self, tick):
+        """ Positions [n, 2], velocities [n, 2] and stopped mask at a tick. """
+        local = (tick + self.offsets) % self.loop_ticks
+        stopped = local < self.stop_ticks
+        first, second = self.segment_lengths[self.routes].T
+        distance = np.minimum(np.maximum(local - self.stop_ticks, 0) * self.tick_seconds * self.speeds, \
+                              first + second)
+        segment = (distance > first).astype(np.int64)
+        agents = np.arange(len(self.ids))
+        start = self.vertices[self.routes, segment]
+        direction = self.vertices[self.routes, segment + 1] - start
+        length = np.where(segment == 0, first, second)
+        direction /= length[:, None]
+        positions = start + direction * (distance - segment * first)[:, None]
+        velocities = direction * np.where(stopped, 0, self.speeds)[:, None]
+        return positions, velocities, direction, stopped
+
+    def __getitem__(self, i):
+        positions, velocities, direction, stopped = self._kinematics(i)
+        _, previous_velocities, previous_direction, _ = self._kinematics(i - 1)
+        yaw = np.degrees(np.arctan2(direction[:, 1], direction[:, 0]))
+        previous_yaw = np.degrees(np.arctan2(previous_direction[:, 1], previous_direction[:, 0]))
+        yaw_rate = ((yaw - previous_yaw + 180) % 360 - 180) / self.tick_seconds
+        zeros = np.zeros((len(self.ids), 1))
+        return FrameState(i * self.frame_step, i * self.tick_seconds, self.ids, np.hstack([positions, zeros]), \
+                          np.hstack([velocities, zeros]), np.hstack([zeros, zeros, yaw_rate[:, None]]), \
+                          np.hstack([(velocities - previous_velocities) / self.tick_seconds, zeros]), \
+                          np.degrees(np.arctan2(direction[:, 0], direction[:, 1])) % 360, \
+                          np.where(stopped, self.light_ids, -1))
+
+class Pacer:
+    """
+    Waits until the wall clock time of each tick: its scene timestamp divided
+    by speed, relative to the first tick. speed None (or 0) does not wait.
+    lags holds how late each tick was released.
+    """
+
+    def __init__(self, speed=None):
+        self.speed = speed
+        self.start = None
+        self.lags = []
+
+    def wait(self, timestamp):
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = (now, timestamp)
+        if not self.speed:
+            return
+        due = self.start[0] + (timestamp - self.start[1]) / self.speed
+        if due > now:
+            time.sleep(due - now)
+        self.lags.append(max(now - due, 0.))
+
+def frame_json(state, geofence=None):
+    """
+    The detection frame dict (the dataset .json format written by
+    parse_data.py, values rounded the same way) of a FrameState, optionally
+    only with the agents inside geofence.
+    """
+    rows = np.arange(len(state)) if geofence is None else np.flatnonzero(in_geofence(state.positions, geofence))
+    positions = state.positions[rows, :2].round(2).tolist()
+    velocities = state.velocities[rows, :2].round(2).tolist()
+    angular_velocities = state.angular_velocities[rows, 2].round(2).tolist()
+    accelerations = state.accelerations[rows, :2].round(2).tolist()
+    objects = [{"position": position, "velocity": velocity, "heading": heading, \
+                "angular velocity": angular_velocity, "acceleration": acceleration, \
+                "light status": {"stopped": int(light_id >= 0), "lightID": max(light_id, 0)}, "id": obj_id} \
+               for position, velocity, heading, angular_velocity, acceleration, light_id, obj_id in \
+               zip(positions, velocities, state.headings[rows].round(1).tolist(), angular_velocities, accelerations, \
+                   state.light_ids[rows].tolist(), state.ids[rows].tolist())]
+    return {"timestamp": np.round(state.timestamp, 2).item(), "object_list": objects, "frame": state.frame, "size": len(objects)}
+
+def replay_frames(scene, pacer=None, geofence=None, num_frames=None):
+    """
+    Yields the frame dicts (see frame_json) of the first num_frames ticks of
+    scene (all of a recorded scene by default), released by pacer (as fast
+    as possible if None).
+    """
+    num_frames = len(scene) if num_frames is None else min(num_frames, len(scene))
+    for i in range(num_frames):
+        state = scene[i]
+        if pacer is not None:
+            pacer.wait(state.timestamp)
+        yield frame_json(state, geofence)
+
+def load_test(scene, name, num_frames, speed=None, geofence=None, keep_dir=None):
+    """
+    Runs a scene through the whole pipeline and times every stage: recording
+    with carla_recorder.Recorder through the fake_carla stand-in, parsing the
+    recordings with parse_data.py, loading and predicting the resulting
+    dataset (see benchmark.py) and online prediction with
+    predictor.Predictor on the replayed frames.
+    """
+    import fake_carla
+    from benchmark import StageTimer, benchmark_dataset
+    from predictor import Predictor
+
+    timer = StageTimer()
+    work_dir = keep_dir or tempfile.mkdtemp()
+    recording_dir, dataset_dir = os.path.join(work_dir, "recordings"), os.path.join(work_dir, name)
+    try:
+        world = fake_carla.World(scene, speed)
+        actor_list = list(world.get_actors())
+        num_ticks = min(num_frames, len(scene) - 1)
+
+        def record():
+            with Recorder(recording_dir, len(actor_list), geofence) as recorder:
+                return record_loop(world, actor_list, recorder, num_ticks * RECORD_EVERY, RECORD_EVERY)
+        tick_seconds = timer.time(name, "record", record, num_ticks * len(actor_list))
+        print("{:<20s} {:<16s} {:9.4f} ms per tick, {} agents".format( \
+              name, "record_tick", 1000 * np.mean(tick_seconds), len(actor_list)))
+
+        def parse():
+            parse_data.MultiAgentScene(recording_dir, geofence=geofence).to_json_dataset(dataset_dir)
+        timer.time(name, "parse", parse, num_ticks)
+        benchmark_dataset(timer, dataset_dir, name, plot_frames=0)
+
+        predictor = Predictor()
+        pacer = Pacer(speed)
+        latencies = []
+        for frame in replay_frames(scene, pacer, geofence, num_frames):
+            start = time.perf_counter()
+            predictor.step(frame)
+            latencies.append(time.perf_counter() - start)
+        latencies = 1000 * np.array(latencies)
+        print("{:<20s} {:<16s} {:9.4f} ms per frame (p99 {:.3f} ms), {:.0f} frames/s".format( \
+              name, "online", latencies.mean(), np.percentile(latencies, 99), 1000 / latencies.mean()))
+        timer.results.append({"dataset": name, "stage": "online", "seconds": latencies.sum() / 1000, \
+                              "items": len(latencies), "items_per_sec": 1000 / latencies.mean(), \
+                              "p99_ms": np.percentile(latencies, 99)})
+        if speed:
+            for stage, lags in [("record", world.pacer.lags), ("online", pacer.lags)]:
+                print("{:<20s} {:<16s} {:9.4f} ms max lag at {:g}x real time".format( \
+                      name, stage + "_lag", 1000 * max(lags, default=0.), speed))
+    finally:
+        if keep_dir is None:
+            shutil.rmtree(work_dir)
+    return timer.results
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description='Replays recordings or synthetic scenes to load-test the pipeline.')
+    parser.add_argument('--source', default=None, help='Recording (myrecording*.txt) or dataset directory to replay.')
+    parser.add_argument('--synthetic', default=1000, type=int, help='Agents of the synthetic scene (without --source).')
+    parser.add_argument('--frames', default=200, type=int, help='Ticks to replay.')
+    parser.add_argument('--speed', default=0, type=float, help='Replay speed relative to real time (0: as fast as possible).')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the synthetic scene.')
+    parser.add_argument('--keep', default=None, help='Keep the recordings and parsed dataset in this directory.')
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_commandline()
+    if args.source is not None:
+        scene = RecordedScene.load(args.source)
+        name = os.path.basename(os.path.normpath(args.source))
+    else:
+        scene = SyntheticScene(args.synthetic, args.seed)
+        name = "synthetic_%d" % args.synthetic
+    load_test(scene, name, args.frames, args.speed, GEOFENCE, args.keep)